@@ -1,9 +1,12 @@
 import os
-import requests
+import sys
 import logging
 from datetime import datetime, timedelta
-from urllib.parse import urlencode
-import csv
+from harvester import build_queries, run_harvest
+from instrumentation import start_run
+from manifest import Manifest, RUN_INCOMPLETE, RUN_OK
+from reference import distritos_concelhos, tipos
+from sparsity import SparsityIndex
 
 # Create folders that don’t exist
 raw_data_folder = "01_RawData"
@@ -19,9 +22,6 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Base URL
-BASE_URL = "https://www.base.gov.pt/Base4/pt/resultados/"
-
 # Fixed search parameters
 base_params = {
     "type": "csv_contratos",
@@ -34,89 +34,6 @@ base_params = {
     "concelho": "0",
 }
 
-# Value ranges for district and municipality
-distritos_concelhos = {
-    2: range(3, 22),
-    3: range(23, 37),
-    4: range(38, 52),
-    5: range(53, 65),
-    6: range(66, 77),
-    7: range(78, 95),
-    8: range(96, 110),
-    9: range(111, 127),
-    10: range(128, 142),
-    11: range(143, 159),
-    12: range(160, 176),
-    13: range(177, 192),
-    14: range(193, 211),
-    15: range(212, 233),
-    16: range(234, 247),
-    17: range(248, 258),
-    18: range(259, 273),
-    19: range(274, 298),
-    20: range(299, 318),
-    21: range(319, 330),
-    22: [0],
-    23: [0],
-    24: [0],
-}
-
-# Types of information from the portal
-tipos = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23]
-
-# HTTP headers with User-Agent
-headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/109.0'
-}
-
-def fetch_data(params):
-    try:
-        url = BASE_URL + "?" + urlencode(params)
-        print(f"URL: {url}")
-        response = requests.get(url, headers=headers)
-
-        if 300 <= response.status_code < 400:
-            redirect_url = response.headers.get('Location')
-            response = requests.get(redirect_url, headers=headers)
-
-        debug_file_path = os.path.join(raw_data_folder, "debug_file.csv")
-        with open(debug_file_path, "wb") as f:
-            f.write(response.content)
-
-        return response, url
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao obter dados: {e}")
-        print(f"Erro fatal: {e}")
-        return None, None
-
-def verify_csv(output_file):
-    try:
-        with open(output_file, "r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            linhas = list(reader)
-            num_registros = len(linhas) - 1
-            if num_registros == 500:
-                logging.info(f"The file {output_file} contains exactly 500 records.")
-            else:
-                logging.warning(f"The file {output_file} contains {num_registros} records, which is different from expected.")
-    except Exception as e:
-        logging.error(f"Error verifying CSV {output_file}: {e}")
-        print(f"Erro fatal: {e}")
-
-def download_csv(link, output_file):
-    try:
-        response = requests.get(link, headers=headers)
-        response.raise_for_status()
-
-        with open(output_file, "wb") as file:
-            file.write(response.content)
-
-        print(f"CSV file saved in: {output_file}")
-        verify_csv(output_file)
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error retrieving the CSV file: {e}")
-        print(f"Fatal Error: {e}")
-
 def generate_monthly_dates(data_inicio, data_fim):
     datas = []
     data_atual = data_inicio
@@ -127,37 +44,53 @@ def generate_monthly_dates(data_inicio, data_fim):
         data_atual = prox_data
     return datas
 
-datas_pesquisa = generate_monthly_dates(
-    data_inicio=datetime(2015, 1, 1),
-    data_fim=datetime(2024, 12, 31)
-)
-
-for desdedata, atedata in datas_pesquisa:
-    for distrito, concelhos in distritos_concelhos.items():
-        for concelho in concelhos:
-            for tipo in tipos:
-                params = base_params.copy()
-                params.update({
-                    "distrito": distrito,
-                    "concelho": concelho,
-                    "tipo": tipo,
-                    "desdedatacontrato": desdedata,
-                    "atedatacontrato": atedata,
-                })
-
-                print(f"Retrieving data: distrito={distrito}, concelho={concelho}, tipo={tipo}, período={desdedata} a {atedata}")
-
-                try:
-                    result, url2 = fetch_data(params)
-
-                    if result and result.status_code == 200 and "text/csv" in result.headers.get("Content-Type", ""):
-                        output_file = os.path.join(
-                            raw_data_folder,
-                            f"csv_resultados_{desdedata}_a_{atedata}_distrito_{distrito}_concelho_{concelho}_tipo_{tipo}.csv"
-                        )
-                        download_csv(url2, output_file)
-                    else:
-                        logging.warning(f"Invalid response for URL: {url2}. Content type: {result.headers.get('Content-Type')}")
-                except Exception as e:
-                    logging.error(f"Error processing distrito={distrito}, concelho={concelho}, tipo={tipo}, período={desdedata}-{atedata}: {e}")
-                    continue
+HARVEST_START = datetime(2015, 1, 1)
+HARVEST_END = datetime(2024, 12, 31)
+
+# Days before the last successful harvest that are fetched again by "sync",
+# because the portal publishes contracts some time after they are signed
+SYNC_TRAILING_DAYS = 60
+
+# Monthly windows to re-fetch in sync mode: from the month of (last harvest - trailing window) up to today
+def generate_sync_dates(last_date, trailing_days=SYNC_TRAILING_DAYS):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if last_date is None:
+        return generate_monthly_dates(HARVEST_START, today)
+    last = min(datetime.strptime(last_date, "%Y-%m-%d"), today)
+    start = (last - timedelta(days=trailing_days)).replace(day=1)
+    return generate_monthly_dates(start, today)
+
+# Measure this run (report in Logs/Runs, see instrumentation.py)
+start_run()
+
+# Usage:
+#   python File01_DownloadBaseGovData.py        full harvest of HARVEST_START..HARVEST_END
+#   python File01_DownloadBaseGovData.py sync   only the windows newer than the last successful harvest
+mode = sys.argv[1] if len(sys.argv) > 1 else "full"
+
+# Download every query concurrently (one request per query).
+# Queries that reach the 500 results limit are split by municipality and by day, then merged back.
+# Subtrees that were mostly empty in past harvests are first checked with one country or district probe.
+with Manifest(raw_data_folder) as manifest:
+    sparsity = SparsityIndex(manifest)
+
+    if mode == "sync":
+        # Every query in the sync windows is fetched again; only partitions whose content changed are marked dirty
+        datas_pesquisa = generate_sync_dates(manifest.last_harvested_date())
+        queries = build_queries(datas_pesquisa, distritos_concelhos, tipos, base_params)
+        run_end = min(datetime.now(), datetime.strptime(datas_pesquisa[-1][1], "%Y-%m-%d")).strftime("%Y-%m-%d")
+    else:
+        # Queries already saved according to the manifest are skipped, so an interrupted run resumes where it stopped
+        datas_pesquisa = generate_monthly_dates(data_inicio=HARVEST_START, data_fim=HARVEST_END)
+        queries = manifest.pending_queries(build_queries(datas_pesquisa, distritos_concelhos, tipos, base_params))
+        run_end = datas_pesquisa[-1][1]
+
+    print(f"Harvest mode: {mode}, período={datas_pesquisa[0][0]} a {run_end}")
+    logging.info(f"Harvest mode: {mode}, período={datas_pesquisa[0][0]} a {run_end}")
+
+    run_id = manifest.start_run(mode, datas_pesquisa[0][0], run_end)
+    results = run_harvest(queries, raw_data_folder, distritos_concelhos, manifest, sparsity)
+    manifest.finish_run(run_id, RUN_OK if results["failed"] == 0 else RUN_INCOMPLETE)
+
+    print(f"Partitions marked dirty: {len(manifest.dirty_keys())}")
+    logging.info(f"Partitions marked dirty: {len(manifest.dirty_keys())}")
@@ -1,12 +1,17 @@
 import os
+import csv
 import logging
+from catalog import catalog
+from instrumentation import start_run
+from parallel import run_parallel
+from query_splitter import RESULT_LIMIT
+from row_count import inspect_file
 
 # Base folder where the CSV files are stored
 BASE_FOLDER = "01_RawData"
 
-# Log files for different categories
-LARGE_FILES_LOG = "large_files.log"  # Files with more than 500 rows
-SMALL_FILES_LOG = "small_files.log"  # Files with 500 rows or less
+# Structured report: one line per file with its size, row count and flags (replaces large_files.log / small_files.log)
+REPORT_FILE = os.path.join("Logs", "row_count_report.csv")
 
 # Configure logging to log both to a file and console
 logging.basicConfig(
@@ -18,7 +23,8 @@ logging.basicConfig(
     ]
 )
 
-# Function to check the number of rows in CSV files
+# Function to check the number of rows in CSV files.
+# Records are counted on the raw bytes (quote-aware, so multi-line fields count once) on all cores.
 def check_files():
     if not os.path.exists(BASE_FOLDER):
         logging.error(f"[ERROR] Folder not found: {BASE_FOLDER}")
@@ -28,39 +34,31 @@ def check_files():
     print("Checking files for row count...\n")
     logging.info("Starting file row count check...")
 
-    # Open logs in append mode so they persist between runs
-    with open(LARGE_FILES_LOG, "a", encoding="utf-8") as large_log, open(SMALL_FILES_LOG, "a", encoding="utf-8") as small_log:
-        for file_name in os.listdir(BASE_FOLDER):
-            file_path = os.path.join(BASE_FOLDER, file_name)
+    tasks = [(entry.name, (entry.path,)) for entry in catalog(BASE_FOLDER)]
+    results = run_parallel(inspect_file, tasks, description="Counting rows")
 
-            # Ensure it's a file and a CSV
-            if not os.path.isfile(file_path) or not file_name.endswith(".csv"):
-                continue
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    large = 0
+    with open(REPORT_FILE, "w", encoding="utf-8", newline="") as report:
+        writer = csv.writer(report, delimiter=";")
+        writer.writerow(["file", "bytes", "rows", "at_limit", "unterminated_quote"])
 
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    row_count = sum(1 for line in f)
+        for file_name, info in results:
+            if info is None:
+                continue  # Logged by run_parallel
 
-                if row_count > 500:
-                    message = f"[LARGE] {file_name} has {row_count} rows."
-                    print(message)
-                    logging.info(message)
-                    large_log.write(f"{file_name} - {row_count} rows\n")
-                    large_log.flush()
-                else:
-                    message = f"[SMALL] {file_name} has {row_count} rows."
-                    print(message)
-                    logging.info(message)
-                    small_log.write(f"{file_name} - {row_count} rows\n")
-                    small_log.flush()
+            # Files with as many rows as the portal returns may be truncated
+            at_limit = info["rows"] >= RESULT_LIMIT
+            large += at_limit
+            writer.writerow([file_name, info["bytes"], info["rows"], int(at_limit), int(info["unterminated_quote"])])
 
-            except Exception as e:
-                error_message = f"[ERROR] Failed to read {file_name}: {e}"
-                print(error_message)
-                logging.error(error_message)
+            if info["unterminated_quote"]:
+                logging.warning(f"[MALFORMED] {file_name} ends inside a quoted field.")
 
-    print("\nFile verification completed.")
-    logging.info("File verification completed.")
+    print(f"\n{large} of {len(results)} files reached {RESULT_LIMIT} rows. Report saved to {REPORT_FILE}.")
+    logging.info(f"File verification completed: {large} of {len(results)} files at the {RESULT_LIMIT} rows limit.")
 
 # Run the check
-check_files()
+if __name__ == "__main__":
+    start_run()
+    check_files()
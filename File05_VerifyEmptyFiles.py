@@ -2,7 +2,12 @@ import os
 import requests
 import logging
 from datetime import datetime, timedelta
-from urllib.parse import urlencode
+from download_client import fetch, is_csv_response
+from harvester import build_queries, output_file_name, write_file
+from instrumentation import start_run
+from manifest import Manifest, STATUS_ERROR, STATUS_FAILED, STATUS_OK, query_key
+from reference import distritos_concelhos, tipos
+from row_count import count_records
 
 # Basic configuration
 BASE_FOLDER = "01_RawData"
@@ -15,28 +20,6 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Base URL
-BASE_URL = "https://www.base.gov.pt/Base4/pt/resultados/"
-
-# HTTP headers with User-Agent
-headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/109.0'
-}
-
-# Value ranges for district and municipality
-distritos_concelhos = {
-    2: range(3, 22), 3: range(23, 37), 4: range(38, 52), 5: range(53, 65),
-    6: range(66, 77), 7: range(78, 95), 8: range(96, 110), 9: range(111, 127),
-    10: range(128, 142), 11: range(143, 159), 12: range(160, 176),
-    13: range(177, 192), 14: range(193, 211), 15: range(212, 233),
-    16: range(234, 247), 17: range(248, 258), 18: range(259, 273),
-    19: range(274, 298), 20: range(299, 318), 21: range(319, 330),
-    22: [0], 23: [0], 24: [0]
-}
-
-# Types of information from the portal
-tipos = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23]
-
 # Function to generate monthly dates
 def generate_monthly_dates(data_inicio, data_fim):
     datas = []
@@ -53,61 +36,60 @@ datas_pesquisa = generate_monthly_dates(
     data_fim=datetime(2024, 12, 1)
 )
 
+# Fixed search parameters
+base_params = {
+    "type": "csv_contratos",
+    "tipo": "",
+    "tipocontrato": "",
+    "sel_price": "price_c1",
+    "sel_date": "date_c1",
+    "pais": "187",
+    "distrito": "0",
+    "concelho": "0",
+}
+
 # Function to download data
-def fetch_data(params, file_path):
+def fetch_data(params, file_path, manifest):
     try:
-        url = BASE_URL + "?" + urlencode(params)
-        response = requests.get(url, headers=headers)
-
-        if 300 <= response.status_code < 400:
-            redirect_url = response.headers.get('Location')
-            response = requests.get(redirect_url, headers=headers)
+        response, url = fetch(params)
 
-        if response.status_code == 200 and "text/csv" in response.headers.get("Content-Type", ""):
-            with open(file_path, "wb") as f:
-                f.write(response.content)
+        if is_csv_response(response):
+            write_file(file_path, response.content)
+            manifest.record(params, STATUS_OK, http_code=response.status_code, file_path=file_path,
+                            content=response.content, rows=count_records(response.content))
             print(f"[DOWNLOAD] File saved: {file_path}")
             logging.info(f"Downloaded file successfully: {file_path}")
         else:
+            manifest.record(params, STATUS_FAILED, http_code=response.status_code)
             print(f"[ERRO] Error downloading file: {file_path}")
             logging.error(f"Error downloading file: {file_path}. URL: {url}")
 
     except requests.exceptions.RequestException as e:
+        manifest.record(params, STATUS_ERROR)
         logging.error(f"Error fetching data: {e}")
         print(f"[ERRO] Fatal error: {e}")
 
-# Loop to check each file
-for desdedata, atedata in datas_pesquisa:
-    for distrito, concelhos in distritos_concelhos.items():
-        for concelho in concelhos:
-            for tipo in tipos:
-                file_name = f"csv_resultados_{desdedata}_a_{atedata}_distrito_{distrito}_concelho_{concelho}_tipo_{tipo}.csv"
-                file_path = os.path.join(BASE_FOLDER, file_name)
+# Measure this run (report in Logs/Runs, see instrumentation.py)
+start_run()
 
-                if os.path.exists(file_path):
-                    if os.path.getsize(file_path) > 0:
-                        print(f"[OK] File exists and is not empty: {file_name}")
-                        continue
-                    else:
-                        print(f"[EMPTY] File is empty: {file_name}. Downloading again...")
-                        logging.warning(f"File is empty: {file_name}. Downloading again...")
-                else:
-                    print(f"[MISSING] File missing: {file_name}. Downloading...")
-                    logging.warning(f"File missing: {file_name}. Downloading...")
+with Manifest(BASE_FOLDER) as manifest:
+    # Files downloaded before the manifest existed are registered once (single directory scan)
+    manifest.import_folder()
+    empty = manifest.empty_keys()
 
-                params = {
-                    "type": "csv_contratos",
-                    "tipo": tipo,
-                    "tipocontrato": "",
-                    "sel_price": "price_c1",
-                    "sel_date": "date_c1",
-                    "pais": "187",
-                    "distrito": distrito,
-                    "concelho": concelho,
-                    "desdedatacontrato": desdedata,
-                    "atedatacontrato": atedata,
-                }
+    # Only queries that are missing or empty according to the manifest are downloaded again
+    queries = build_queries(datas_pesquisa, distritos_concelhos, tipos, base_params)
+    for params in manifest.pending_queries(queries, non_empty=True):
+        file_name = output_file_name(params)
+        file_path = os.path.join(BASE_FOLDER, file_name)
+
+        if query_key(params) in empty:
+            print(f"[EMPTY] File is empty: {file_name}. Downloading again...")
+            logging.warning(f"File is empty: {file_name}. Downloading again...")
+        else:
+            print(f"[MISSING] File missing: {file_name}. Downloading...")
+            logging.warning(f"File missing: {file_name}. Downloading...")
 
-                fetch_data(params, file_path)
+        fetch_data(params, file_path, manifest)
 
 print("\nVerification and download concluded.")
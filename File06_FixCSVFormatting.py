@@ -1,16 +1,23 @@
 import os
-import pandas as pd
 import logging
 import sys
+from catalog import catalog
+from csv_repair import quarantine_path_for, repair_csv
+from instrumentation import start_run
+from parallel import run_parallel
+from storage import file_name as storage_file_name, is_up_to_date
 
 # Source and destination folders
 SOURCE_FOLDER = '05_RawDataFinalMonth'
 DESTINATION_FOLDER = '07_RawDataFinalMonthFixed'
 LOG_FOLDER = 'Logs'
+QUARANTINE_FOLDER = os.path.join(LOG_FOLDER, 'Quarantine')
+FAILED_LOG_FILE = os.path.join(LOG_FOLDER, 'failed_files.log')
 
 # Ensure folders exist
 os.makedirs(DESTINATION_FOLDER, exist_ok=True)
 os.makedirs(LOG_FOLDER, exist_ok=True)
+os.makedirs(QUARANTINE_FOLDER, exist_ok=True)
 
 # Logging configuration
 logging.basicConfig(
@@ -22,53 +29,47 @@ logging.basicConfig(
     ]
 )
 
-# Verify and fix CSV using pandas
+# Verify and fix CSV in one streaming pass (output in the storage format, bad records quarantined).
+# Runs in a worker process; errors are captured by run_parallel and written to the failed files log.
 def fix_csv(file_path, output_path):
-    try:
-        # Read the CSV using pandas, attempting with 'latin1' or 'utf-8' encoding
-        df = pd.read_csv(file_path, sep=';', on_bad_lines='skip', encoding="utf-8")  # Try 'utf-8' first
-        
-        # Write the fixed CSV to the destination folder, maintaining the original title
-        df.to_csv(output_path, index=False, sep=';', encoding="utf-8")  # Save in 'utf-8' encoding
-        
-        logging.info(f"Fixed and saved file: {output_path}")
-        
-    except UnicodeDecodeError:
-        # If a UnicodeDecodeError occurs, try with 'latin1' encoding
-        logging.warning(f"Unicode decode error for {file_path}. Trying 'latin1' encoding.")
-        try:
-            df = pd.read_csv(file_path, sep=';', on_bad_lines='skip', encoding="latin1")
-            df.to_csv(output_path, index=False, sep=';', encoding="utf-8")
-            logging.info(f"Fixed and saved file with 'latin1' encoding: {output_path}")
-        except Exception as e:
-            logging.error(f"Error processing file {file_path}: {e}")
-    
-    except Exception as e:
-        logging.error(f"Error processing file {file_path}: {e}")
+    file_name = os.path.basename(file_path)
+    stats = repair_csv(file_path, output_path, quarantine_path_for(QUARANTINE_FOLDER, file_name))
+
+    if stats["latin1_lines"]:
+        logging.warning(f"{stats['latin1_lines']} lines of {file_path} were not UTF-8 and were read as 'latin1'.")
+    if stats["bad_rows"]:
+        logging.warning(f"{stats['bad_rows']} malformed rows of {file_path} moved to {QUARANTINE_FOLDER}.")
+
+    logging.info(f"Fixed and saved file: {output_path} ({stats['rows']} rows, {stats['bad_rows']} skipped, {stats['padded_rows']} padded)")
+    return stats
 
 # Main function to process files
 def process_files():
-    files = os.listdir(SOURCE_FOLDER)
-
-    for file_name in files:
-        if not file_name.endswith('.csv'):
-            continue
+    # One cached directory scan of the source folder instead of a listdir
+    files = catalog(SOURCE_FOLDER)
+    tasks = []
 
-        source_file_path = os.path.join(SOURCE_FOLDER, file_name)
-        destination_file_path = os.path.join(DESTINATION_FOLDER, file_name)
+    for entry in files:
+        file_name = entry.name
+        source_file_path = entry.path
+        destination_name = storage_file_name(os.path.splitext(file_name)[0])
+        destination_file_path = os.path.join(DESTINATION_FOLDER, destination_name)
 
-        # Check if the file has already been processed
-        if os.path.exists(destination_file_path):
+        # Check if the file has already been processed (a source changed since then is fixed again).
+        # Both files are stat'ed: a file rewritten in place keeps its folder's mtime, so the mtimes
+        # of a cached catalog can be stale.
+        if is_up_to_date(destination_file_path, [source_file_path]):
             logging.info(f"File {file_name} already exists in the destination folder. Skipping processing.")
             continue  # Skip processing this file
 
-        logging.info(f"Processing file: {file_name}")
+        tasks.append((file_name, (source_file_path, destination_file_path)))
 
-        # Process and save the fixed file
-        fix_csv(source_file_path, destination_file_path)
+    # Process and save the fixed files in parallel
+    run_parallel(fix_csv, tasks, failed_log_file=FAILED_LOG_FILE, description="Fixing files")
 
     logging.info('File processing completed.')
 
 # Run the script
 if __name__ == "__main__":
+    start_run()
     process_files()
@@ -1,5 +1,6 @@
 import os
-import shutil
+from catalog import catalog, names
+from file_links import link_file
 
 # Source and destination folders
 SOURCE_FOLDER = '02_RawDataDay'
@@ -8,14 +9,13 @@ DESTINATION_FOLDER = '03_FixedRawDataDay'
 # Ensure destination folder exists
 os.makedirs(DESTINATION_FOLDER, exist_ok=True)
 
-# List all files in the source folder
-files = os.listdir(SOURCE_FOLDER)
+# List all files in the source folder and the files already in the destination (one cached scan each)
+files = catalog(SOURCE_FOLDER)
+existing = names(catalog(DESTINATION_FOLDER))
 
-for file_name in files:
-    if not file_name.endswith('.csv'):
-        continue
-
-    original_file_path = os.path.join(SOURCE_FOLDER, file_name)
+for entry in files:
+    file_name = entry.name
+    original_file_path = entry.path
 
     if file_name.endswith('_fixed.csv'):
         # Remove '_fixed' from the filename for the fixed file
@@ -24,9 +24,10 @@ for file_name in files:
         # Construct destination path
         destination_file_path = os.path.join(DESTINATION_FOLDER, new_file_name)
 
-        # Overwrite the existing file with the fixed version
-        shutil.copy2(original_file_path, destination_file_path)
-        print(f'Overwritten {new_file_name} with fixed version from {file_name}')
+        # Overwrite the existing file with the fixed version (linked, not copied, when possible)
+        method = link_file(original_file_path, destination_file_path)
+        existing.add(new_file_name)
+        print(f'Overwritten {new_file_name} with fixed version from {file_name} ({method})')
     
     else:
         # For non-fixed files, use the original name
@@ -35,10 +36,11 @@ for file_name in files:
         # Construct destination path for non-fixed files
         destination_file_path = os.path.join(DESTINATION_FOLDER, new_file_name)
 
-        # Copy non-fixed files (no overwrite)
-        if not os.path.exists(destination_file_path):
-            shutil.copy2(original_file_path, destination_file_path)
-            print(f'Copied {file_name} to {new_file_name}')
+        # Link or copy non-fixed files (no overwrite)
+        if new_file_name not in existing:
+            method = link_file(original_file_path, destination_file_path)
+            existing.add(new_file_name)
+            print(f'Copied {file_name} to {new_file_name} ({method})')
         else:
             print(f'Skipping {file_name} as {new_file_name} already exists')
 
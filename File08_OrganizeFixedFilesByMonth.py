@@ -4,6 +4,7 @@ import logging
 import sys
 from datetime import datetime
 from collections import defaultdict
+from catalog import catalog
 
 # Source and destination folders
 SOURCE_FOLDER = '03_FixedRawDataDay'
@@ -28,21 +29,19 @@ logging.basicConfig(
 def group_files_by_month(files):
     grouped_files = defaultdict(list)
     
-    for file_name in files:
-        if not file_name.endswith('.csv'):
-            continue
-        
-        parts = file_name.replace(".csv", "").split("_")
-        
-        if len(parts) != 11:  # Checking for exactly 11 parts
+    for entry in files:
+        file_name = entry.name
+
+        # Names are parsed once by the catalog
+        if entry.desde is None:
             logging.warning(f"Skipping file with unexpected format: {file_name}")
             continue
 
         # Extract relevant information
-        start_date = parts[2]
-        district = parts[6]
-        municipality = parts[8]
-        data_type = parts[10]
+        start_date = entry.desde
+        district = entry.distrito
+        municipality = entry.concelho
+        data_type = entry.tipo
         
         try:
             # Get the month and year from the start date
@@ -81,13 +80,16 @@ def process_groups(grouped_files):
             output_file_name = f"csv_resultados_{start_date}_a_{end_date}_distrito_{district}_concelho_{municipality}_tipo_{data_type}.csv"
             output_file_path = os.path.join(DESTINATION_FOLDER, output_file_name)
             
-            # Save the concatenated file
-            merged_df.to_csv(output_file_path, index=False, sep=';', encoding="utf-8")
+            # Save the concatenated file under a hidden name, then replace the output (changes the folder's
+            # mtime, which the catalogs of catalog.py rely on)
+            temp_path = os.path.join(DESTINATION_FOLDER, "." + output_file_name)
+            merged_df.to_csv(temp_path, index=False, sep=';', encoding="utf-8")
+            os.replace(temp_path, output_file_path)
             logging.info(f"Saved merged file: {output_file_name}")
 
 # Main function
 def process_files():
-    files = os.listdir(SOURCE_FOLDER)
+    files = catalog(SOURCE_FOLDER)
     
     grouped_files = group_files_by_month(files)
     process_groups(grouped_files)
@@ -1,7 +1,9 @@
 import os
-import shutil
 import logging
 import sys
+from catalog import catalog, names
+from file_links import LINK_MODE, link_file
+from manifest import Manifest
 
 # Define folder paths
 RAW_DATA_FOLDER = '01_RawData'
@@ -37,17 +39,20 @@ def log_copied_file(file_name, action):
     # Log to console and main log file
     logging.info(log_message)
 
-def copy_files(source_folder, destination_folder, overwrite=False):
-    files = os.listdir(source_folder)
-    for file_name in files:
-        source_file = os.path.join(source_folder, file_name)
+# Copy the files of source_folder to destination_folder. Existing files are kept unless overwrite is set
+# or their name is in refresh (raw files downloaded again with a new content). Returns the names copied.
+def copy_files(source_folder, destination_folder, overwrite=False, refresh=()):
+    # One cached directory scan per folder instead of isfile() / exists() per file
+    files = catalog(source_folder)
+    existing = names(catalog(destination_folder))
+    copied = set()
+    for entry in files:
+        file_name = entry.name
+        source_file = entry.path
         destination_file = os.path.join(destination_folder, file_name)
-        
-        if not os.path.isfile(source_file):
-            continue
-        
-        if os.path.exists(destination_file):
-            if overwrite:
+
+        if file_name in existing:
+            if overwrite or file_name in refresh:
                 action = "Overwritten"
             else:
                 action = "Skipped (Already Exists)"
@@ -57,21 +62,38 @@ def copy_files(source_folder, destination_folder, overwrite=False):
             action = "Copied"
 
         try:
-            shutil.copy2(source_file, destination_file)
-            log_copied_file(file_name, action)
+            # Hardlink / reflink when the file system supports it, copy otherwise
+            method = link_file(source_file, destination_file)
+            log_copied_file(file_name, f"{action} ({method})")
+            copied.add(file_name)
         except Exception as e:
             logging.error(f"Error copying {file_name}: {e}")
 
+    return copied
+
 if __name__ == "__main__":
-    logging.info("Starting file copying process...")
+    logging.info(f"Starting file copying process (link mode: {LINK_MODE})...")
 
     # Clear the copied files log before each run
     open(COPIED_FILES_LOG, "w").close()
     
-    # Step 1: Copy all files from 01_RawData to 05_RawDataFinalMonth
-    logging.info("Copying files from 01_RawData to 05_RawDataFinalMonth...")
-    copy_files(RAW_DATA_FOLDER, FINAL_MONTH_FOLDER, overwrite=False)
-    
+    with Manifest(RAW_DATA_FOLDER) as manifest:
+        # Raw files marked dirty by the downloaders (new, or downloaded again with a new content)
+        dirty = manifest.dirty_keys()
+        changed = {
+            entry.name: (entry.desde, entry.ate, entry.distrito, entry.concelho, entry.tipo)
+            for entry in catalog(RAW_DATA_FOLDER)
+            if (entry.desde, entry.ate, entry.distrito, entry.concelho, entry.tipo) in dirty
+        }
+
+        # Step 1: Copy all files from 01_RawData to 05_RawDataFinalMonth (the dirty ones are copied again)
+        logging.info("Copying files from 01_RawData to 05_RawDataFinalMonth...")
+        copied = copy_files(RAW_DATA_FOLDER, FINAL_MONTH_FOLDER, overwrite=False, refresh=changed)
+
+        # The dirty raw files are now in 05_RawDataFinalMonth
+        manifest.clear_dirty([key for file_name, key in changed.items() if file_name in copied])
+        logging.info(f"{len(copied & changed.keys())} of {len(changed)} dirty raw files copied again.")
+
     # Step 2: Copy all files from 04_FixedRawDataMonth to 05_RawDataFinalMonth (Overwriting)
     logging.info("Copying files from 04_FixedRawDataMonth to 05_RawDataFinalMonth (Overwriting)...")
     copy_files(FIXED_MONTH_FOLDER, FINAL_MONTH_FOLDER, overwrite=True)
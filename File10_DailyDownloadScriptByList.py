@@ -2,8 +2,9 @@ import os
 import requests
 import logging
 from datetime import datetime, timedelta
-from urllib.parse import urlencode
 import sys
+from download_client import build_url, fetch, is_csv_response
+from instrumentation import start_run
 
 # Folders
 DAILY_FOLDER = "06_RawDataDayMissingData"
@@ -17,14 +18,6 @@ os.makedirs(LOG_FOLDER, exist_ok=True)
 LARGE_FILES_LOG = "error_files.log"
 DAILY_LOG = os.path.join(LOG_FOLDER, "error_files.log")
 
-# Base URL
-BASE_URL = "https://www.base.gov.pt/Base4/pt/resultados/"
-
-# HTTP headers
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/109.0'
-}
-
 # Logging configuration
 logging.basicConfig(
     level=logging.INFO,
@@ -46,11 +39,10 @@ def generate_daily_dates(month_start):
 # Fetch data
 def fetch_data(params, output_path):
     try:
-        url = BASE_URL + "?" + urlencode(params)
-        logging.info(f"Requesting URL: {url}")  # Log URL for debugging
-        response = requests.get(url, headers=HEADERS)
+        logging.info(f"Requesting URL: {build_url(params)}")  # Log URL for debugging
+        response, _ = fetch(params)
         
-        if response.status_code == 200 and "text/csv" in response.headers.get("Content-Type", ""):
+        if is_csv_response(response):
             with open(output_path, "wb") as f:
                 f.write(response.content)
             logging.info(f"File downloaded successfully: {output_path}")
@@ -101,4 +93,5 @@ def process_daily_downloads():
                 logging.info(f"Successfully downloaded: {output_file}")
 
 if __name__ == "__main__":
+    start_run()
     process_daily_downloads()
@@ -1,17 +1,23 @@
 import os
-import pandas as pd
 import logging
 import sys
+from catalog import catalog
+from csv_repair import quarantine_path_for, repair_csv
+from instrumentation import start_run
+from parallel import run_parallel
+from storage import file_name as storage_file_name
 
 # Source and destination folders
 SOURCE_FOLDER = '05_RawDataFinalMonth'
 DESTINATION_FOLDER = '07_RawDataFinalMonthFixed'
 LOG_FOLDER = 'Logs'
 FAILED_LOG_FILE = os.path.join(LOG_FOLDER, 'failed_files.log')
+QUARANTINE_FOLDER = os.path.join(LOG_FOLDER, 'Quarantine')
 
 # Ensure folders exist
 os.makedirs(DESTINATION_FOLDER, exist_ok=True)
 os.makedirs(LOG_FOLDER, exist_ok=True)
+os.makedirs(QUARANTINE_FOLDER, exist_ok=True)
 
 # Logging configuration
 logging.basicConfig(
@@ -23,61 +29,38 @@ logging.basicConfig(
     ]
 )
 
-# Helper function to log failed files
-def log_failed_file(file_name, error_message):
-    with open(FAILED_LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(f"Failed to process {file_name}: {error_message}\n")
-
-# Verify and fix CSV using pandas
+# Verify and fix CSV in one streaming pass (output in the storage format, bad records quarantined).
+# Runs in a worker process; errors are captured by run_parallel and written to the failed files log.
 def fix_csv(file_path, output_path, file_name):
-    try:
-        # Read the CSV using pandas, attempting with 'utf-8' encoding first
-        df = pd.read_csv(file_path, sep=';', on_bad_lines='skip', encoding="utf-8")  # Try 'utf-8' first
-        
-        # Write the fixed CSV to the destination folder, maintaining the original title
-        df.to_csv(output_path, index=False, sep=';', encoding="utf-8")  # Save in 'utf-8' encoding
-        
-        logging.info(f"Fixed and saved file: {output_path}")
-        
-    except UnicodeDecodeError:
-        # If a UnicodeDecodeError occurs, try with 'latin1' encoding
-        logging.warning(f"Unicode decode error for {file_name}. Trying 'latin1' encoding.")
-        try:
-            df = pd.read_csv(file_path, sep=';', on_bad_lines='skip', encoding="latin1")
-            df.to_csv(output_path, index=False, sep=';', encoding="utf-8")
-            logging.info(f"Fixed and saved file with 'latin1' encoding: {output_path}")
-        except Exception as e:
-            error_message = f"Error processing {file_name}: {e}"
-            logging.error(error_message)
-            log_failed_file(file_name, error_message)  # Log the failed file
+    stats = repair_csv(file_path, output_path, quarantine_path_for(QUARANTINE_FOLDER, file_name))
+
+    if stats["latin1_lines"]:
+        logging.warning(f"{stats['latin1_lines']} lines of {file_name} were not UTF-8 and were read as 'latin1'.")
+    if stats["bad_rows"]:
+        logging.warning(f"{stats['bad_rows']} malformed rows of {file_name} moved to {QUARANTINE_FOLDER}.")
 
-    except Exception as e:
-        error_message = f"Error processing {file_name}: {e}"
-        logging.error(error_message)
-        log_failed_file(file_name, error_message)  # Log the failed file
+    logging.info(f"Fixed and saved file: {output_path} ({stats['rows']} rows, {stats['bad_rows']} skipped, {stats['padded_rows']} padded)")
+    return stats
 
 # Main function to process files
 def process_files():
-    files = os.listdir(SOURCE_FOLDER)
-
-    for file_name in files:
-        if not file_name.endswith('.csv'):
-            continue
+    files = catalog(SOURCE_FOLDER)
+    tasks = []
 
-        source_file_path = os.path.join(SOURCE_FOLDER, file_name)
-        destination_file_path = os.path.join(DESTINATION_FOLDER, file_name)
+    for entry in files:
+        file_name = entry.name
+        source_file_path = entry.path
+        destination_file_path = os.path.join(DESTINATION_FOLDER, storage_file_name(os.path.splitext(file_name)[0]))
 
-        logging.info(f"Processing file: {file_name}")
+        # Process and save the fixed file, overwriting if it already exists
+        tasks.append((file_name, (source_file_path, destination_file_path, file_name)))
 
-        try:
-            # Process and save the fixed file, overwriting if it already exists
-            fix_csv(source_file_path, destination_file_path, file_name)
-        except Exception as e:
-            # In case of failure, log the file name and error
-            log_failed_file(file_name, str(e))
+    # Failed files are logged in FAILED_LOG_FILE by run_parallel
+    run_parallel(fix_csv, tasks, failed_log_file=FAILED_LOG_FILE, description="Fixing files")
 
     logging.info('File processing completed.')
 
 # Run the script
 if __name__ == "__main__":
+    start_run()
     process_files()
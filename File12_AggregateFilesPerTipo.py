@@ -1,7 +1,11 @@
 import os
-import pandas as pd
-from glob import glob
 import logging
+from collections import defaultdict
+from append_writer import AppendWriter, union_columns
+from dimensions import tipo_name
+from instrumentation import start_run
+from parallel import run_parallel
+from storage import file_name as storage_file_name, is_built_from, list_files, read_table, record_inputs
 
 # Path settings
 input_folder = '07_RawDataFinalMonthFixed'
@@ -19,51 +23,71 @@ logging.basicConfig(
 )
 
 # Group files by (start_date, end_date, distrito, concelho)
-from collections import defaultdict
-file_groups = defaultdict(list)
+def group_files():
+    file_groups = defaultdict(list)
 
-# Organize files by group
-for file in glob(os.path.join(input_folder, '*.csv')):
-    file_name = os.path.basename(file)
-    parts = file_name.split('_')
-    
-    if len(parts) < 11:
-        logging.warning(f"Skipping file with unexpected format: {file_name}")
-        continue
+    # Organize files by group
+    for file in list_files(input_folder):
+        file_name = os.path.basename(file)
+        parts = file_name.split('_')
 
-    desdedata = parts[2]
-    atedata = parts[4]
-    distrito = parts[6]
-    concelho = parts[8]
-    tipo = parts[10].split('.')[0]
+        if len(parts) < 11:
+            logging.warning(f"Skipping file with unexpected format: {file_name}")
+            continue
 
-    key = (desdedata, atedata, distrito, concelho)
-    file_groups[key].append((file, tipo))
+        desdedata = parts[2]
+        atedata = parts[4]
+        distrito = parts[6]
+        concelho = parts[8]
+        tipo = parts[10].split('.')[0]
 
-# Process each group
-for (desdedata, atedata, distrito, concelho), files in file_groups.items():
-    combined_df = pd.DataFrame()
+        key = (desdedata, atedata, distrito, concelho)
+        file_groups[key].append((file, tipo))
 
-    for file, tipo in files:
-        file_name = os.path.basename(file)
-        try:
-            df = pd.read_csv(file, sep=';', encoding='utf-8', on_bad_lines='skip')
-            df['Tipo'] = tipo
-            combined_df = pd.concat([combined_df, df], ignore_index=True)
-            logging.info(f"Loaded {file_name} with {len(df)} rows.")
-            print(f"Loaded {file_name} with {len(df)} rows.")
-        except Exception as e:
-            logging.error(f"Failed to process {file_name}: {e}")
-            print(f"Failed to process {file_name}: {e}")
-            continue
+    return file_groups
 
-    output_filename = f"csv_resultados_{desdedata}_a_{atedata}_distrito_{distrito}_concelho_{concelho}.csv"
+# Combine the files of one group, adding the Tipo and TipoDescricao columns (runs in a worker process).
+# Rows are appended to the output file one input at a time. The description is written here, so the
+# files are complete when saved and File13 does not need to rewrite them.
+def process_group(output_filename, files):
     output_path = os.path.join(output_folder, output_filename)
 
-    try:
-        combined_df.to_csv(output_path, index=False, sep=';', encoding='utf-8')
-        logging.info(f"Saved combined file: {output_filename} with {len(combined_df)} rows.")
-        print(f"Saved combined file: {output_filename} with {len(combined_df)} rows.")
-    except Exception as e:
-        logging.error(f"Failed to save {output_filename}: {e}")
-        print(f"Failed to save {output_filename}: {e}")
+    # Errors while saving are captured by run_parallel and written to the failed files log
+    columns = union_columns([file for file, _ in files], ("Tipo", "TipoDescricao"))
+    failed = []
+    with AppendWriter(output_path, columns) as writer:
+        for file, tipo in files:
+            file_name = os.path.basename(file)
+            try:
+                df = read_table(file)
+                writer.append(df, Tipo=tipo, TipoDescricao=tipo_name(tipo))
+                logging.info(f"Loaded {file_name} with {len(df)} rows.")
+                print(f"Loaded {file_name} with {len(df)} rows.")
+            except Exception as e:
+                logging.error(f"Failed to process {file_name}: {e}")
+                print(f"Failed to process {file_name}: {e}")
+                failed.append(file)
+                continue
+
+    # A group with a failed input is not recorded, so it is combined again on the next run
+    if not failed:
+        record_inputs(output_path, [file for file, _ in files])
+    logging.info(f"Saved combined file: {output_filename} with {writer.rows} rows.")
+    print(f"Saved combined file: {output_filename} with {writer.rows} rows.")
+    return writer.rows
+
+# Process each group in parallel
+if __name__ == "__main__":
+    start_run()
+    file_groups = group_files()
+    tasks = []
+    for (desdedata, atedata, distrito, concelho), files in file_groups.items():
+        output_filename = storage_file_name(f"csv_resultados_{desdedata}_a_{atedata}_distrito_{distrito}_concelho_{concelho}")
+
+        # Only the groups with a changed, added or removed input are combined again
+        if is_built_from(os.path.join(output_folder, output_filename), [file for file, _ in files]):
+            logging.info(f"{output_filename} is up to date. Skipping.")
+            continue
+        tasks.append((output_filename, (output_filename, files)))
+
+    run_parallel(process_group, tasks, description="Aggregating per tipo")
@@ -1,7 +1,9 @@
 import os
-import pandas as pd
 import logging
-from glob import glob
+from instrumentation import start_run
+from parallel import run_parallel
+from reference import tipo_descricao_map
+from storage import columns_of, list_files, read_table, write_table
 
 # Folder path
 folder_path = '08_RawDataMonthWithTipo'
@@ -14,54 +16,42 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Tipo description mapping
-tipo_descricao_map = {
-    "0": "Todos",
-    "1": "Ajuste Direto Regime Geral",
-    "2": "Concurso público",
-    "3": "Concurso limitado por prévia qualificação",
-    "4": "Procedimento de negociação",
-    "5": "Diálogo concorrencial",
-    "6": "Ao abrigo de acordo-quadro (art.º 258.º)",
-    "7": "Ao abrigo de acordo-quadro (art.º 259.º)",
-    "8": "Consulta Prévia",
-    "9": "Parceria para a inovação",
-    "10": "Disponibilização de bens móveis",
-    "11": "Serviços sociais e outros serviços específicos",
-    "13": "Concurso de conceção simplificado",
-    "14": "Concurso de ideias simplificado",
-    "15": "Consulta Prévia Simplificada",
-    "16": "Concurso público simplificado",
-    "17": "Concurso limitado por prévia qualificação simplificado",
-    "18": "Ajuste Direto Regime Geral ao abrigo do artigo 7º da Lei n.º 30/2021, de 21.05",
-    "19": "Consulta prévia ao abrigo do artigo 7º da Lei n.º 30/2021, de 21.05",
-    "20": "Ajuste direto simplificado",
-    "21": "Ajuste direto simplificado ao abrigo da Lei n.º 30/2021, de 21.05",
-    "22": "Setores especiais – isenção parte II",
-    "23": "Contratação excluída II"
-}
-
-# Process each CSV in the folder
-csv_files = glob(os.path.join(folder_path, '*.csv'))
-
-for file in csv_files:
+# Add 'TipoDescricao' to one file, replacing it (runs in a worker process).
+# Files that already have the column (File12 writes it) are left untouched, so a rerun
+# does not rewrite them or change their modification time.
+def add_tipo_descricao(file):
     file_name = os.path.basename(file)
     try:
-        df = pd.read_csv(file, sep=';', encoding='utf-8', on_bad_lines='skip')
+        if 'TipoDescricao' in columns_of(file):
+            return 0
+
+        df = read_table(file)
 
         if 'Tipo' not in df.columns:
             logging.warning(f"'Tipo' column not found in {file_name}. Skipping.")
-            continue
+            return 0
 
         # Convert 'Tipo' to string for safe mapping
         df['Tipo'] = df['Tipo'].astype(str)
         df['TipoDescricao'] = df['Tipo'].map(tipo_descricao_map).fillna("Desconhecido")
 
-        # Overwrite original file
-        df.to_csv(file, index=False, sep=';', encoding='utf-8')
+        # Replace the original file in one step: a hidden temporary file (ignored by list_files)
+        # is renamed over it, so an interrupted run never leaves a partial file
+        temp_path = os.path.join(folder_path, "." + file_name)
+        write_table(df, temp_path)
+        os.replace(temp_path, file)
         logging.info(f"Updated {file_name} with 'TipoDescricao'.")
         print(f"Updated {file_name} with 'TipoDescricao'.")
+        return len(df)
 
     except Exception as e:
         logging.error(f"Error processing {file_name}: {e}")
         print(f"Error processing {file_name}: {e}")
+        raise
+
+# Process each file in the folder in parallel
+if __name__ == "__main__":
+    start_run()
+    files = list_files(folder_path)
+    tasks = [(os.path.basename(file), (file,)) for file in files]
+    run_parallel(add_tipo_descricao, tasks, description="Adding TipoDescricao")
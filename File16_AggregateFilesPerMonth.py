@@ -1,9 +1,11 @@
 import os
-import pandas as pd
-from glob import glob
 from collections import defaultdict
 import logging
 from datetime import datetime
+from append_writer import AppendWriter, union_columns
+from instrumentation import start_run, track
+from reference import distrito_names
+from storage import file_name as storage_file_name, is_built_from, list_files, read_table, record_inputs
 
 # Input and output folders
 input_folder = '09_RawDataMonthWithCounty'
@@ -14,40 +16,15 @@ os.makedirs(output_folder, exist_ok=True)
 log_file_path = os.path.join(output_folder, "processing_log.log")
 logging.basicConfig(filename=log_file_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Distrito mapping
-distrito_names = {
-    "0": "Todos",
-    "2": "Aveiro",
-    "3": "Beja",
-    "4": "Braga",
-    "5": "Braganca",
-    "6": "Castelo Branco",
-    "7": "Coimbra",
-    "8": "Évora",
-    "9": "Faro",
-    "10": "Guarda",
-    "11": "Leiria",
-    "12": "Lisboa",
-    "13": "Portalegre",
-    "14": "Porto",
-    "15": "Santarém",
-    "16": "Setúbal",
-    "17": "Viana do Castelo",
-    "18": "Vila Real",
-    "19": "Viseu",
-    "20": "Região Autónoma dos Açores",
-    "21": "Região Autónoma da Madeira",
-    "22": "Portugal Continental",
-    "23": "Distrito não determinado",
-    "24": "Consulado situados no estrangeiro"
-}
+# Measure this run (report in Logs/Runs, see instrumentation.py)
+start_run()
 
 # Group files by (start_date, end_date)
 file_groups = defaultdict(list)
 
-for file in glob(os.path.join(input_folder, '*.csv')):
+for file in list_files(input_folder):
     file_name = os.path.basename(file)
-    file_stem = os.path.splitext(file_name)[0]  # Remove .csv
+    file_stem = os.path.splitext(file_name)[0]  # Remove the extension
     parts = file_stem.split('_')
 
     if len(parts) < 7:
@@ -72,38 +49,45 @@ for file in glob(os.path.join(input_folder, '*.csv')):
 
 # Merge files per month
 for (desdedata, atedata), files in file_groups.items():
-    merged_df = pd.DataFrame()
-
-    for file in files:
-        file_name = os.path.basename(file)
-        try:
-            df = pd.read_csv(file, sep=';', encoding='utf-8', on_bad_lines='skip')
-
-            # Get district ID from filename (remove .csv)
-            district_id_str = os.path.splitext(file_name.split('_')[-1])[0]
-
-            if district_id_str not in distrito_names:
-                logging.warning(f"Invalid or unknown district ID in file: {file_name}")
-                continue
-
-            df['DistritoId'] = district_id_str
-            df['DistritoNome'] = distrito_names[district_id_str]
-
-            merged_df = pd.concat([merged_df, df], ignore_index=True)
-            logging.info(f"Loaded {file_name} with {len(df)} rows.")
-            print(f"Loaded {file_name} with {len(df)} rows.")
-        except Exception as e:
-            logging.error(f"Failed to process {file_name}: {e}")
-            print(f"Failed to process {file_name}: {e}")
-
     # Save merged file without distrito in filename
-    output_filename = f"csv_resultados_{desdedata}_a_{atedata}.csv"
+    output_filename = storage_file_name(f"csv_resultados_{desdedata}_a_{atedata}")
     output_path = os.path.join(output_folder, output_filename)
 
+    # Only the months with a changed, added or removed district file are merged again
+    if is_built_from(output_path, files):
+        logging.info(f"{output_filename} is up to date. Skipping.")
+        continue
+
     try:
-        merged_df.to_csv(output_path, index=False, sep=';', encoding='utf-8')
-        logging.info(f"Saved merged file: {output_filename} with {len(merged_df)} rows.")
-        print(f"Saved merged file: {output_filename} with {len(merged_df)} rows.")
+        # Rows are appended to the output file one district file at a time
+        columns = union_columns(files, ("DistritoId", "DistritoNome"))
+        failed = []
+        with track(output_filename), AppendWriter(output_path, columns) as writer:
+            for file in files:
+                file_name = os.path.basename(file)
+
+                # Get district ID from filename (remove the extension)
+                district_id_str = os.path.splitext(file_name.split('_')[-1])[0]
+
+                if district_id_str not in distrito_names:
+                    logging.warning(f"Invalid or unknown district ID in file: {file_name}")
+                    continue
+
+                try:
+                    df = read_table(file)
+                    writer.append(df, DistritoId=district_id_str, DistritoNome=distrito_names[district_id_str])
+                    logging.info(f"Loaded {file_name} with {len(df)} rows.")
+                    print(f"Loaded {file_name} with {len(df)} rows.")
+                except Exception as e:
+                    logging.error(f"Failed to process {file_name}: {e}")
+                    print(f"Failed to process {file_name}: {e}")
+                    failed.append(file)
+
+        # A month with a failed district file is not recorded, so it is merged again on the next run
+        if not failed:
+            record_inputs(output_path, files)
+        logging.info(f"Saved merged file: {output_filename} with {writer.rows} rows.")
+        print(f"Saved merged file: {output_filename} with {writer.rows} rows.")
     except Exception as e:
         logging.error(f"Failed to save {output_filename}: {e}")
         print(f"Failed to save {output_filename}: {e}")
@@ -1,9 +1,10 @@
 import os
-import pandas as pd
-from glob import glob
 from collections import defaultdict
 from datetime import datetime
 import logging
+from append_writer import AppendWriter, union_columns
+from instrumentation import start_run, track
+from storage import file_name as storage_file_name, is_built_from, list_files, read_table, record_inputs
 
 # Paths
 input_folder = '10_RawDataMonthWithDistrict'
@@ -14,10 +15,13 @@ os.makedirs(output_folder, exist_ok=True)
 log_file_path = os.path.join(output_folder, "yearly_merge_log.log")
 logging.basicConfig(filename=log_file_path, level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Measure this run (report in Logs/Runs, see instrumentation.py)
+start_run()
+
 # Group files by year (from start date in filename)
 year_groups = defaultdict(list)
 
-for file in glob(os.path.join(input_folder, '*.csv')):
+for file in list_files(input_folder):
     file_name = os.path.basename(file)
     parts = file_name.split('_')
     
@@ -36,25 +40,34 @@ for file in glob(os.path.join(input_folder, '*.csv')):
 
 # Merge files per year
 for year, files in year_groups.items():
-    merged_df = pd.DataFrame()
-    
-    for file in files:
-        try:
-            df = pd.read_csv(file, sep=';', encoding='utf-8', on_bad_lines='skip',dtype={26: str}, low_memory=False)
-            merged_df = pd.concat([merged_df, df], ignore_index=True)
-            logging.info(f"Loaded {file} with {len(df)} rows.")
-            print(f"Loaded {file} with {len(df)} rows.")
-        except Exception as e:
-            logging.error(f"Failed to process {file}: {e}")
-            print(f"Failed to process {file}: {e}")
-
-    output_file = f"csv_resultados_{year}.csv"
+    output_file = storage_file_name(f"csv_resultados_{year}")
     output_path = os.path.join(output_folder, output_file)
 
+    # Only the years with a changed, added or removed monthly file are merged again
+    if is_built_from(output_path, files):
+        logging.info(f"{output_file} is up to date. Skipping.")
+        continue
+
     try:
-        merged_df.to_csv(output_path, index=False, sep=';', encoding='utf-8')
-        logging.info(f"Saved merged file: {output_file} with {len(merged_df)} rows.")
-        print(f"Saved merged file: {output_file} with {len(merged_df)} rows.")
+        # Rows are appended to the yearly file one monthly file at a time (values kept as text)
+        failed = []
+        with track(output_file), AppendWriter(output_path, union_columns(sorted(files))) as writer:
+            for file in sorted(files):
+                try:
+                    df = read_table(file)
+                    writer.append(df)
+                    logging.info(f"Loaded {file} with {len(df)} rows.")
+                    print(f"Loaded {file} with {len(df)} rows.")
+                except Exception as e:
+                    logging.error(f"Failed to process {file}: {e}")
+                    print(f"Failed to process {file}: {e}")
+                    failed.append(file)
+
+        # A year with a failed monthly file is not recorded, so it is merged again on the next run
+        if not failed:
+            record_inputs(output_path, files)
+        logging.info(f"Saved merged file: {output_file} with {writer.rows} rows.")
+        print(f"Saved merged file: {output_file} with {writer.rows} rows.")
     except Exception as e:
         logging.error(f"Failed to save {output_file}: {e}")
         print(f"Failed to save {output_file}: {e}")
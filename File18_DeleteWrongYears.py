@@ -1,25 +1,39 @@
 import os
-import pandas as pd
+import sys
+import csv
 from glob import glob
-from datetime import datetime
+from append_writer import AppendWriter
+from contract_dates import DATE_COLUMN, filter_year
+from dataset import DATASET_FOLDER, PART_FILE_NAME, iter_year, years
+from dedup import DedupIndex
+from instrumentation import start_run, track
+from storage import file_name as storage_file_name, is_built_from, iter_batches, list_files, record_inputs
 
 # Input and output folders
 input_folder = '11_RawDataYear'
 output_folder = '13_RawDataYearsCorrect'
 os.makedirs(output_folder, exist_ok=True)
 
-# Function to extract year from contract date string
-def extract_year(date_str):
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%d").year
-    except Exception as e:
-        print(f"Error extracting year from date string {date_str}: {e}")
-        return None
+# Per-year counts of kept, dropped (other year), unparseable and duplicate rows
+report_path = os.path.join('Logs', 'year_filter_report.csv')
+os.makedirs(os.path.dirname(report_path), exist_ok=True)
+
+# Measure this run (report in Logs/Runs, see instrumentation.py)
+start_run()
+
+# Inputs: the yearly files of 11_, or the years of the partitioned dataset
+# (`python File18_DeleteWrongYears.py dataset`, see File24)
+if len(sys.argv) > 1 and sys.argv[1] == "dataset":
+    inputs = [(storage_file_name(f"csv_resultados_{year}"), None) for year in years()]
+else:
+    inputs = [(os.path.basename(file_path), file_path) for file_path in list_files(input_folder)]
+
+report = []
+
+# Process each file in chunks: the filter mask only needs the date column,
+# and the rows that pass are appended to the output as they are read
+for file_name, file_path in inputs:
 
-# Process each file
-for file_path in glob(os.path.join(input_folder, "*.csv")):
-    file_name = os.path.basename(file_path)
-    
     # Extract year from filename, e.g., csv_resultados_2015.csv → 2015
     try:
         year = int(file_name.split("_")[2].split(".")[0])
@@ -27,48 +41,62 @@ for file_path in glob(os.path.join(input_folder, "*.csv")):
         print(f"Skipping file with unexpected name format: {file_name}")
         continue
 
-    # Load file with proper encoding handling
-    try:
-        df = pd.read_csv(file_path, sep=';', encoding='utf-8', on_bad_lines='skip', low_memory=False)
-    except UnicodeDecodeError:
-        print(f"Unicode decode error for {file_name}, trying ISO-8859-1 encoding.")
-        try:
-            df = pd.read_csv(file_path, sep=';', encoding='ISO-8859-1', on_bad_lines='skip', low_memory=False)
-        except Exception as e:
-            print(f"Error reading {file_name} with ISO-8859-1 encoding: {e}")
-            continue
-    except Exception as e:
-        print(f"Error reading {file_name}: {e}")
-        continue
+    output_path = os.path.join(output_folder, storage_file_name(os.path.splitext(file_name)[0]))
 
-    if 'Data de Celebração do Contrato' not in df.columns:
-        print(f"'Data de Celebração do Contrato' column missing in {file_name}")
+    # Check if the output is newer than its inputs (the yearly file, or the partitions of the year)
+    # and was built from the same ones
+    sources = [file_path] if file_path else glob(os.path.join(DATASET_FOLDER, f"Ano={year}", "**", PART_FILE_NAME), recursive=True)
+    if is_built_from(output_path, sources):
+        print(f"File {file_name} is up to date in the output folder. Skipping.")
         continue
 
-    # Ensure the 'Data de Celebração do Contrato' column is parsed as datetime
+    counts = {"year": year, "rows": 0, "kept": 0, "dropped": 0, "unparseable": 0, "duplicates": 0}
+    batches = iter_batches(file_path) if file_path else iter_year(year)
+
     try:
-        df['Data de Celebração do Contrato'] = pd.to_datetime(df['Data de Celebração do Contrato'], errors='coerce', dayfirst=True)
-    except Exception as e:
-        print(f"Error converting 'Data de Celebração do Contrato' to datetime in {file_name}: {e}")
-        continue
+        index = DedupIndex()
+        with track(file_name), AppendWriter(output_path) as writer:
 
-    # Filter rows where the contract year matches the filename year
-    df['AnoContrato'] = df['Data de Celebração do Contrato'].dt.year
-    df_filtered = df[df['AnoContrato'] == year].drop(columns=['AnoContrato'])
+            for df in batches:
+                if DATE_COLUMN not in df.columns:
+                    raise KeyError(f"'{DATE_COLUMN}' column missing")
 
-    # Check if filtered dataframe has rows
-    if df_filtered.empty:
-        print(f"No data found for year {year} in {file_name}. Skipping file.")
+                filtered, unparseable = filter_year(df, year)
+                unique, duplicates = index.filter(filtered, year)
+                writer.append(unique)
+
+                counts["rows"] += len(df)
+                counts["kept"] += len(unique)
+                counts["unparseable"] += unparseable
+                counts["duplicates"] += duplicates
+                counts["dropped"] += len(df) - len(filtered) - unparseable
+    except Exception as e:
+        print(f"Error processing {file_name}: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
         continue
 
-    # Save the cleaned file
-    output_path = os.path.join(output_folder, file_name)
-    
-    # Check if the file already exists in the destination folder
-    if os.path.exists(output_path):
-        print(f"File {file_name} already exists in the output folder. Skipping saving.")
+    # Check if any rows were kept
+    if counts["kept"] == 0:
+        print(f"No data found for year {year} in {file_name}. Skipping file.")
+        if os.path.exists(output_path):
+            os.remove(output_path)
     else:
-        df_filtered.to_csv(output_path, index=False, sep=';', encoding='utf-8')
-        print(f"Saved {file_name} with {len(df_filtered)} valid rows.")
-    
+        record_inputs(output_path, sources)
+        print(f"Saved {file_name} with {counts['kept']} valid rows ({counts['dropped']} from other years, "
+              f"{counts['unparseable']} with unparseable dates and {counts['duplicates']} duplicates dropped).")
+
+    report.append(counts)
+
+# Write the report and print a summary table
+with open(report_path, 'w', encoding='utf-8', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=["year", "rows", "kept", "dropped", "unparseable", "duplicates"], delimiter=';')
+    writer.writeheader()
+    writer.writerows(report)
+
+print(f"{'Year':>6} {'Rows':>10} {'Kept':>10} {'Dropped':>10} {'Unparseable':>12} {'Duplicates':>11}")
+for counts in report:
+    print(f"{counts['year']:>6} {counts['rows']:>10} {counts['kept']:>10} {counts['dropped']:>10} "
+          f"{counts['unparseable']:>12} {counts['duplicates']:>11}")
+
 print("Processing completed.")
@@ -0,0 +1,47 @@
+import os
+import sys
+import logging
+from dataset import DATASET_FOLDER, write_partition
+from instrumentation import start_run
+from parallel import run_parallel
+from storage import list_files
+
+# Source folder (fixed monthly files) and log folder
+INPUT_FOLDER = '07_RawDataFinalMonthFixed'
+LOG_FOLDER = 'Logs'
+
+# Ensure folders exist (the log is kept outside the dataset folder)
+os.makedirs(DATASET_FOLDER, exist_ok=True)
+os.makedirs(LOG_FOLDER, exist_ok=True)
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_FOLDER, "contract_dataset_log.log"), encoding="utf-8"),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Add one fixed monthly file to the dataset (runs in a worker process)
+def add_file(file_path):
+    file_name = os.path.basename(file_path)
+    rows = write_partition(file_path)
+    if rows is None:
+        logging.info(f"Partition of {file_name} is up to date. Skipping.")
+    else:
+        logging.info(f"Added {file_name} with {rows} rows.")
+    return rows
+
+# Build the partitioned dataset from 07_ in parallel.
+# This replaces the File12 -> File14/File15 -> File16 -> File17 copies (08_ to 11_);
+# File18 reads it with `python File18_DeleteWrongYears.py dataset`.
+if __name__ == "__main__":
+    start_run()
+    files = list_files(INPUT_FOLDER)
+    tasks = [(os.path.basename(file_path), (file_path,)) for file_path in files]
+    results = run_parallel(add_file, tasks, description="Building contract dataset")
+
+    written = [rows for _, rows in results if rows is not None]
+    logging.info(f"Dataset {DATASET_FOLDER}: {len(written)} partitions written ({sum(written)} rows), {len(results) - len(written)} up to date or failed.")
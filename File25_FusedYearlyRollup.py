@@ -0,0 +1,132 @@
+import os
+import sys
+import logging
+from collections import defaultdict
+from append_writer import AppendWriter, union_columns
+from contract_dates import DATE_COLUMN, filter_year
+from dataset import partition_of, save_partition
+from dedup import DedupIndex
+from instrumentation import start_run
+from parallel import run_parallel
+from dimensions import DISTRITO_NAMES, concelho_name, distrito_name, tipo_name
+from storage import DERIVED_COLUMN_TYPES, file_name as storage_file_name, is_built_from, list_files, read_table, record_inputs
+
+# Source folder (fixed monthly files), output folder (yearly files) and log folder
+INPUT_FOLDER = '07_RawDataFinalMonthFixed'
+OUTPUT_FOLDER = '13_RawDataYearsCorrect'
+LOG_FOLDER = 'Logs'
+
+# Ensure folders exist
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(LOG_FOLDER, exist_ok=True)
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_FOLDER, "fused_rollup_log.log"), encoding="utf-8"),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Group the fixed monthly files by year (from the start date in the file name)
+def group_files():
+    year_groups = defaultdict(list)
+
+    for file_path in list_files(INPUT_FOLDER):
+        file_name = os.path.basename(file_path)
+        partition = partition_of(file_name)
+
+        if partition is None:
+            logging.warning(f"Skipping file with unexpected format: {file_name}")
+            continue
+
+        year_groups[partition["Ano"]].append((file_path, partition))
+
+    return year_groups
+
+# Add the columns of File12, File13, File15 and File16 to the rows of one monthly file.
+# The values are constant per file, so each column is a single broadcast assignment;
+# codes stay integers and the names are dictionary-encoded when saved (see storage.py).
+def enrich(df, partition):
+    tipo = partition["Tipo"]
+    concelho = partition["ConcelhoId"]
+    distrito = partition["DistritoId"]
+
+    return df.assign(
+        Tipo=tipo,
+        TipoDescricao=tipo_name(tipo),
+        ConcelhoId=concelho,
+        ConcelhoNome=concelho_name(concelho),
+        DistritoId=distrito,
+        DistritoNome=distrito_name(distrito),
+    )
+
+# Build the yearly file of one year from its monthly files (runs in a worker process).
+# Each monthly file is read once, enriched, filtered, deduplicated and appended to the yearly file.
+# With keep_intermediate the rows of each monthly file are also saved to the partitioned dataset (File24).
+def process_year(year, files, keep_intermediate=False):
+    output_filename = storage_file_name(f"csv_resultados_{year}")
+    output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+    rows_in = 0
+    duplicates = 0
+    failed = []
+
+    # Errors while saving are captured by run_parallel and written to the failed files log
+    columns = union_columns([file_path for file_path, _ in files], DERIVED_COLUMN_TYPES)
+    index = DedupIndex()
+    with AppendWriter(output_path, columns) as writer:
+        for file_path, partition in files:
+            file_name = os.path.basename(file_path)
+
+            if partition["DistritoId"] not in DISTRITO_NAMES:
+                logging.warning(f"Invalid or unknown district ID in file: {file_name}")
+                continue
+
+            try:
+                df = read_table(file_path)
+                if keep_intermediate:
+                    save_partition(df, partition)
+
+                if DATE_COLUMN not in df.columns:
+                    logging.warning(f"'{DATE_COLUMN}' column missing in {file_name}. Skipping.")
+                    continue
+
+                rows_in += len(df)
+                filtered, _ = filter_year(enrich(df, partition), year)
+                unique, dropped = index.filter(filtered, year)
+                duplicates += dropped
+                writer.append(unique)
+            except Exception as e:
+                logging.error(f"Failed to process {file_name}: {e}")
+                failed.append(file_path)
+                continue
+
+    if writer.rows == 0 and os.path.exists(output_path):
+        os.remove(output_path)
+        logging.info(f"No data found for year {year}. Nothing saved.")
+    else:
+        # A year with a failed monthly file is not recorded, so it is built again on the next run
+        if not failed:
+            record_inputs(output_path, [file_path for file_path, _ in files])
+        logging.info(f"Saved {output_filename} with {writer.rows} of {rows_in} rows ({duplicates} duplicates dropped).")
+    return rows_in, writer.rows, duplicates
+
+# Replace the File12 -> File13 -> File15 -> File16 -> File17 -> File18 cascade with one pass per year.
+# `python File25_FusedYearlyRollup.py keep` also writes the partitioned dataset for debugging.
+if __name__ == "__main__":
+    start_run()
+    keep_intermediate = len(sys.argv) > 1 and sys.argv[1] == "keep"
+    tasks = []
+
+    for year, files in sorted(group_files().items()):
+        # A yearly file is up to date when it is newer than all its monthly files and was built from the same ones
+        output_path = os.path.join(OUTPUT_FOLDER, storage_file_name(f"csv_resultados_{year}"))
+        if is_built_from(output_path, [file_path for file_path, _ in files]) and not keep_intermediate:
+            logging.info(f"Yearly file for {year} is up to date. Skipping.")
+            continue
+        tasks.append((str(year), (year, files, keep_intermediate)))
+
+    run_parallel(process_year, tasks, description="Building yearly files")
+    logging.info('Fused rollup completed.')
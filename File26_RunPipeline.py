@@ -0,0 +1,49 @@
+import os
+import sys
+import logging
+from instrumentation import start_run
+from pipeline import FUSED_STAGES, STAGE_BLOCKED, STAGE_FAILED, STAGES, dependencies, run
+
+LOG_FOLDER = 'Logs'
+
+# Ensure the log folder exists
+os.makedirs(LOG_FOLDER, exist_ok=True)
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_FOLDER, "pipeline_log.log"), encoding="utf-8"),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Run the processing stages (File02, File06 to File09, File12 to File18, File24) in dependency order,
+# skipping the stages whose inputs and outputs did not change since their last run.
+#   python File26_RunPipeline.py                 all stages
+#   python File26_RunPipeline.py county year     these stages and the stages upstream of them
+# Options: --force (run the selected stages even when up to date), --dry-run (only list the stages
+# that would run), --fused (File25 instead of the File12 -> File18 cascade), --list (print the stages)
+# The run report of all stages (Logs/Runs/<run id>/report.json) is written at exit, see instrumentation.py.
+if __name__ == "__main__":
+    start_run()
+    options = {arg for arg in sys.argv[1:] if arg.startswith("--")}
+    targets = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    stages = FUSED_STAGES if "--fused" in options else STAGES
+
+    if "--list" in options:
+        upstream = dependencies(stages)
+        for stage in stages:
+            after = ", ".join(sorted(upstream[stage.name])) or "-"
+            print(f"{stage.name:<14} {' + '.join(stage.scripts):<75} after: {after}")
+        sys.exit(0)
+
+    outcomes = run(stages, targets, force="--force" in options, dry_run="--dry-run" in options)
+
+    print(f"\n{'Stage':<14} {'Outcome':<8}")
+    for name, outcome in outcomes.items():
+        print(f"{name:<14} {outcome:<8}")
+
+    if any(outcome in (STAGE_FAILED, STAGE_BLOCKED) for outcome in outcomes.values()):
+        sys.exit(1)
@@ -0,0 +1,84 @@
+import os
+import sys
+import csv
+import logging
+from contract_types import COLUMN_TYPES, cast_file
+from instrumentation import start_run
+from list_columns import parse_list_columns
+from parallel import run_parallel
+from storage import is_built_from, record_inputs
+
+# API data (one file per year), typed output and log folder
+INPUT_FOLDER = '18_ParquetFiles_APIbaseGov'
+OUTPUT_FOLDER = '19_DataTyped'
+LOG_FOLDER = 'Logs'
+REPORT_FILE = os.path.join(LOG_FOLDER, 'type_cast_report.csv')
+
+# Ensure folders exist
+os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(LOG_FOLDER, exist_ok=True)
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_FOLDER, "type_cast_log.log"), encoding="utf-8"),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Cast one file of the API data (runs in a worker process); None when the output is up to date.
+# The lists mode is recorded with the output, so switching modes casts the files again.
+def cast_one(file_path, parse_lists):
+    file_name = os.path.basename(file_path)
+    output_path = os.path.join(OUTPUT_FOLDER, os.path.splitext(file_name)[0] + '.parquet')
+    options = {"lists": parse_lists}
+    if is_built_from(output_path, [file_path], options):
+        logging.info(f"{file_name} is up to date. Skipping.")
+        return None
+
+    # Written under a hidden name first, so an interrupted cast never looks up to date
+    temp_path = os.path.join(OUTPUT_FOLDER, '.' + os.path.basename(output_path))
+    rows, failures = cast_file(file_path, temp_path, transform=parse_list_columns if parse_lists else None)
+    os.replace(temp_path, output_path)
+    record_inputs(output_path, [file_path], options)
+    failed = {column: count for column, count in failures.items() if count}
+    logging.info(f"Cast {file_name}: {rows} rows, parse failures: {failed or 'none'}")
+    return rows, failures
+
+# Cast the yearly files of the API data to the typed schema of contract_types.py (the casts of File20),
+# chunk by chunk, and write them as typed Parquet. The parse failures per file and column go to REPORT_FILE.
+#   python File27_CastContractTypes.py          casts only
+#   python File27_CastContractTypes.py lists    also parses the list columns (list_columns.py)
+if __name__ == "__main__":
+    start_run()
+    parse_lists = "lists" in sys.argv[1:]
+    files = sorted(
+        os.path.join(INPUT_FOLDER, name) for name in os.listdir(INPUT_FOLDER)
+        if name.endswith(('.parquet', '.csv', '.arrow'))
+    )
+    tasks = [(os.path.basename(file_path), (file_path, parse_lists)) for file_path in files]
+    results = run_parallel(cast_one, tasks, description="Casting contract types")
+
+    # The counts of the files cast in this run replace theirs in the report; the files that were up to
+    # date (or failed, keeping their previous output) keep their previous counts
+    kept = {file_name for file_name, result in results if result is None}
+    report = []
+    if os.path.exists(REPORT_FILE):
+        with open(REPORT_FILE, encoding='utf-8', newline='') as f:
+            report = list(csv.reader(f, delimiter=';'))[1:]
+    report = [row for row in report if row[0] in kept]
+    for file_name, result in results:
+        if result is None:
+            continue
+        rows, failures = result
+        report.extend([file_name, rows, column, COLUMN_TYPES[column], count] for column, count in failures.items())
+
+    with open(REPORT_FILE, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['file', 'rows', 'column', 'type', 'failures'])
+        writer.writerows(sorted(report, key=lambda row: row[0]))
+
+    cast = [result for _, result in results if result is not None]
+    logging.info(f"{len(cast)} files cast ({sum(rows for rows, _ in cast)} rows), {len(results) - len(cast)} up to date or failed. Report saved to {REPORT_FILE}")
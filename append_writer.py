@@ -0,0 +1,80 @@
+import os
+from instrumentation import add
+from storage import ArrowFileWriter, columns_of, contract_schema, forget_inputs, format_of, to_arrow
+
+# Header of an output that combines input_paths: the union of their columns (read from the headers /
+# schemas only, in order of first appearance) followed by the derived columns. The portal exports gained
+# columns over the years, so a group's first file does not always have all of them.
+def union_columns(input_paths, derived_columns=()):
+    columns = []
+    for path in input_paths:
+        columns.extend(column for column in columns_of(path) if column not in columns)
+    columns.extend(column for column in derived_columns if column not in columns)
+    return columns
+
+# Writes the rows of several DataFrames to one output file, one DataFrame at a time.
+# The format follows the extension of output_path (';'-separated CSV, Parquet or Arrow IPC, see storage.py).
+# The header / schema is columns (see union_columns), or else the columns of the first DataFrame;
+# every DataFrame is aligned to it, with '' for the columns it lacks.
+# Peak memory is one input DataFrame, instead of the whole group as with repeated pd.concat.
+# The rows go to a hidden temporary file that replaces output_path when the writer is closed without
+# an error, so the folder's mtime changes (see catalog.catalog) and a failed rewrite keeps the old output.
+class AppendWriter:
+    def __init__(self, output_path, columns=None):
+        self.output_path = output_path
+        self.temp_path = os.path.join(os.path.dirname(output_path), "." + os.path.basename(output_path))
+        self.storage_format = format_of(output_path)
+        self.columns = list(columns) if columns else None
+        self.header_written = False
+        self.rows = 0
+        self.file = None
+        self.writer = None
+
+        # The record of inputs of the old output is dropped first, so an output left by an interrupted
+        # rewrite is never taken for an up-to-date one (see storage.is_built_from)
+        forget_inputs(output_path)
+        if self.storage_format == "csv":
+            self.file = open(self.temp_path, 'w', encoding='utf-8', newline='')
+
+    # Append the rows of df, adding the derived columns given as keyword arguments (e.g. Tipo='1')
+    def append(self, df, **derived_columns):
+        if derived_columns:
+            df = df.assign(**derived_columns)
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+        extra = [column for column in df.columns if column not in self.columns]
+        if extra:
+            raise ValueError(f"Columns {extra} are not in the header of {self.output_path}")
+        df = df.reindex(columns=self.columns, fill_value='')
+        header = not self.header_written
+        self.header_written = True
+
+        if self.storage_format == "csv":
+            df.to_csv(self.file, index=False, sep=';', header=header)
+        else:
+            if self.writer is None:
+                self.writer = ArrowFileWriter(self.temp_path, contract_schema(self.columns, self.storage_format))
+            self.writer.write(to_arrow(df, self.writer.schema))
+        self.rows += len(df)
+        add(rows_out=len(df))
+
+    # Close the temporary file and move it over the output, or remove it when keep is False (on an error)
+    def close(self, keep=True):
+        if self.file is not None:
+            self.file.close()
+        if self.writer is not None:
+            self.writer.close()
+        if not os.path.exists(self.temp_path):
+            return
+        if not keep:
+            os.remove(self.temp_path)
+            return
+        os.replace(self.temp_path, self.output_path)
+        add(bytes_written=os.path.getsize(self.output_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(keep=exc_type is None)
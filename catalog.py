@@ -0,0 +1,91 @@
+import os
+import pickle
+import threading
+import hashlib
+import logging
+from collections import namedtuple
+from manifest import parse_file_name
+
+# Cached catalogs, one file per scanned folder
+CATALOG_CACHE_FOLDER = os.path.join('Logs', 'Catalog')
+
+# One file of a data folder: the stat results of the scan and the query parameters parsed from its name
+# (desde, ate, distrito, concelho and tipo are None when the name has another format)
+FileEntry = namedtuple("FileEntry", ["name", "path", "size", "mtime", "desde", "ate", "distrito", "concelho", "tipo"])
+
+# Scan a folder once with os.scandir: its entries sorted by name and the names of its subfolders.
+# Hidden files (the temporary outputs of csv_repair.py and File27) are left out.
+def scan(folder, extensions=(".csv",)):
+    entries = []
+    subfolders = []
+    with os.scandir(folder) as folder_entries:
+        for entry in folder_entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subfolders.append(entry.name)
+                continue
+            if os.path.splitext(entry.name)[1] not in extensions or not entry.is_file():
+                continue
+            stat = entry.stat()
+            params = parse_file_name(entry.name, extensions) or {}
+            entries.append(FileEntry(
+                entry.name, entry.path, stat.st_size, stat.st_mtime,
+                params.get("desdedatacontrato"), params.get("atedatacontrato"),
+                params.get("distrito"), params.get("concelho"), params.get("tipo"),
+            ))
+    entries.sort(key=lambda entry: entry.name)
+    return entries, sorted(subfolders)
+
+def cache_path(folder, extensions):
+    key = hashlib.sha1(f"{os.path.abspath(folder)}|{','.join(extensions)}".encode("utf-8")).hexdigest()
+    return os.path.join(CATALOG_CACHE_FOLDER, key + ".pickle")
+
+# Catalog of a folder, reused while the folder's mtime is unchanged. Adding, removing or replacing a
+# file changes it, but rewriting a file in place does not: writers of cataloged folders must replace
+# their files (the downloaders, file_links, csv_repair.py, File08 and append_writer.py do). A missing
+# folder is empty.
+def catalog(folder, extensions=(".csv",)):
+    return cached_scan(folder, extensions)[0]
+
+# scan() of a folder through the cache of catalog()
+def cached_scan(folder, extensions):
+    if not os.path.isdir(folder):
+        return [], []
+
+    # Read the mtime before scanning: a change during the scan invalidates the cache on the next call
+    folder_mtime = os.stat(folder).st_mtime_ns
+    path = cache_path(folder, extensions)
+
+    try:
+        with open(path, "rb") as f:
+            cached_mtime, entries, subfolders = pickle.load(f)
+        if cached_mtime == folder_mtime:
+            return entries, subfolders
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+
+    entries, subfolders = scan(folder, extensions)
+
+    # The same folder can be cataloged by several stages of File26 at once: one temporary file per writer
+    os.makedirs(CATALOG_CACHE_FOLDER, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump((folder_mtime, entries, subfolders), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+    logging.info(f"Catalog of {folder}: {len(entries)} files scanned.")
+    return entries, subfolders
+
+# Catalog of a folder followed by those of its subfolders (e.g. the year= / DistritoId= partitions of a
+# dataset), in name order. Each folder is scanned again only when its own mtime changed.
+def catalog_tree(folder, extensions=(".csv",)):
+    entries, subfolders = cached_scan(folder, extensions)
+    entries = list(entries)
+    for subfolder in subfolders:
+        entries.extend(catalog_tree(os.path.join(folder, subfolder), extensions))
+    return entries
+
+# Names of the files of a catalog
+def names(entries):
+    return {entry.name for entry in entries}
@@ -0,0 +1,27 @@
+import pandas as pd
+
+# Contract date that decides the year of a row (File18, File25)
+DATE_COLUMN = 'Data de Celebração do Contrato'
+
+# Known format of the contract dates; the values that do not match it are parsed one distinct value at a time
+DATE_FORMAT = "%Y-%m-%d"
+
+# Parse contract dates: one vectorized parse with the known format, and the old day-first
+# inference only for the misses (each distinct value parsed once). Unparseable values are NaT.
+def parse_dates(values):
+    dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    misses = dates.isna() & values.notna() & (values != '')
+    if misses.any():
+        missed = values[misses]
+        parsed = {value: pd.to_datetime(value, errors='coerce', dayfirst=True) for value in missed.unique()}
+        dates[misses] = pd.to_datetime(missed.map(parsed))
+    return dates
+
+# Keep the rows of df signed in the given year; the date is written back as YYYY-MM-DD.
+# Returns the filtered rows and the number of rows whose date could not be parsed.
+def filter_year(df, year):
+    dates = parse_dates(df[DATE_COLUMN])
+    mask = dates.dt.year == year
+    filtered = df[mask].copy()
+    filtered[DATE_COLUMN] = dates[mask].dt.strftime(DATE_FORMAT)
+    return filtered, int(dates.isna().sum())
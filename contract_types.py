@@ -0,0 +1,144 @@
+import pandas as pd
+import pyarrow as pa
+from storage import ArrowFileWriter, BATCH_ROWS, iter_batches
+
+# Typed schema of the API contract data (18_ParquetFiles_APIbaseGov, cleaned in File20).
+# Kinds: "string", "int" (nullable Int64), "float", "bool", "date" and "list" (kept as is).
+COLUMN_TYPES = {
+    "idcontrato": "int",
+    "nAnuncio": "string",
+    "TipoAnuncio": "string",
+    "idINCM": "int",
+    "tipoContrato": "string",
+    "idprocedimento": "int",
+    "tipoprocedimento": "string",
+    "objectoContrato": "string",
+    "descContrato": "string",
+    "adjudicante": "list",
+    "adjudicatarios": "list",
+    "dataPublicacao": "date",
+    "dataCelebracaoContrato": "date",
+    "precoContratual": "float",
+    "cpv": "list",
+    "prazoExecucao": "int",
+    "localExecucao": "list",
+    "fundamentacao": "string",
+    "ProcedimentoCentralizado": "bool",
+    "numAcordoQuadro": "int",
+    "DescrAcordoQuadro": "string",
+    "precoBaseProcedimento": "float",
+    "dataDecisaoAdjudicacao": "date",
+    "dataFechoContrato": "date",
+    "PrecoTotalEfetivo": "float",
+    "regime": "string",
+    "justifNReducEscrContrato": "string",
+    "tipoFimContrato": "string",
+    "CritMateriais": "bool",
+    "concorrentes": "list",
+    "linkPecasProc": "string",
+    "Observacoes": "string",
+    "ContratEcologico": "bool",
+    "Ano": "int",
+    "fundamentAjusteDireto": "string",
+}
+
+# Placeholder values replaced before the cast (None: missing)
+REPLACEMENTS = {
+    "idINCM": {"": None, "-1": None},
+    "numAcordoQuadro": {"NULL": None},
+    "DescrAcordoQuadro": {"NULL": ""},
+}
+
+# All the dates of the API data are day/month/year
+DATE_FORMAT = "%d/%m/%Y"
+
+# Values of the Sim/Não columns ("NÃ£o" is "Não" read with the wrong encoding)
+BOOL_VALUES = {"Sim": True, "Nao": False, "Não": False, "NÃ£o": False}
+
+PANDAS_TYPES = {"string": "string", "int": "Int64", "float": "float64", "bool": "boolean"}
+
+# Types of the Parquet files written from the schema (the list columns keep the type they are read with:
+# lists in the API Parquet files, printed lists in CSV)
+ARROW_TYPES = {
+    "string": pa.string(),
+    "int": pa.int64(),
+    "float": pa.float64(),
+    "bool": pa.bool_(),
+    "date": pa.date32(),
+}
+
+# Values that hold something (not null and not blank); a value that is present but cannot be
+# cast is a parse failure
+def present(values):
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return values.notna()
+    return values.notna() & (values.astype("string").str.strip() != "")
+
+# Cast one column. Returns the cast values and the number of parse failures.
+def cast_column(values, kind):
+    if kind == "list":
+        return values, 0
+    if kind == "string":
+        return values.astype("string"), 0
+
+    if kind == "date":
+        cast = pd.to_datetime(values.astype("string").str.strip(), format=DATE_FORMAT, errors="coerce")
+    elif kind == "bool":
+        cast = values.astype("string").str.strip().map(BOOL_VALUES).astype("boolean")
+    else:
+        cast = pd.to_numeric(values, errors="coerce")
+        if kind == "int":
+            # Values with decimals are not integers: failures, not truncated
+            cast = cast.where(cast.isna() | (cast % 1 == 0)).astype("Int64")
+        else:
+            cast = cast.astype(PANDAS_TYPES[kind])
+
+    failures = int((present(values) & cast.isna()).sum())
+    return cast, failures
+
+# Cast every column of df in one pass, replacing the columns (no *_string copies).
+# failures counts the parse failures per column and is updated in place, so it can be
+# shared by the chunks of a file. Columns missing from the schema are left as they are.
+def cast_table(df, failures=None, column_types=COLUMN_TYPES):
+    failures = {} if failures is None else failures
+    for column, kind in column_types.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if column in REPLACEMENTS:
+            values = values.replace(REPLACEMENTS[column])
+        df[column], failed = cast_column(values, kind)
+        failures[column] = failures.get(column, 0) + failed
+    return df, failures
+
+# Arrow schema for the columns of df: the schema types for the typed columns, the inferred types
+# for the others (list columns, the parsed columns of list_columns.py). A column that is empty in
+# the first chunk is written as text.
+def arrow_schema(df, column_types=COLUMN_TYPES):
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    fields = []
+    for column in df.columns:
+        column_type = ARROW_TYPES.get(column_types.get(column), inferred.field(column).type)
+        fields.append(pa.field(column, pa.string() if pa.types.is_null(column_type) else column_type))
+    return pa.schema(fields)
+
+# Cast a CSV / Parquet / Arrow file chunk by chunk and write it as Parquet with the schema types.
+# transform (optional) is applied to every cast chunk, e.g. list_columns.parse_list_columns.
+# Returns the number of rows and the parse failures per column.
+def cast_file(input_path, output_path, transform=None, batch_rows=BATCH_ROWS):
+    failures = {}
+    rows = 0
+    writer = None
+    try:
+        for df in iter_batches(input_path, batch_rows=batch_rows):
+            df, failures = cast_table(df, failures)
+            if transform is not None:
+                df = transform(df)
+            if writer is None:
+                writer = ArrowFileWriter(output_path, arrow_schema(df))
+            writer.write(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, failures
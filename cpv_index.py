@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# CPV code: 8 digits, dash, check digit (e.g. 79625000-1)
+CPV_CODE = r'\d{8}-\d'
+
+# One CPV code per (row, code), indexed by the row position. A value is a list / array / tuple of
+# codes, a string holding one or more codes (a printed list or tuple) or null.
+def codes_of(values):
+    values = values.reset_index(drop=True)
+    kinds = values.map(type)
+
+    from_lists = values[kinds.isin([list, tuple, np.ndarray])].explode().dropna().astype(str)
+    from_text = values[kinds == str].str.findall(CPV_CODE).explode().dropna()
+
+    codes = pd.concat([from_lists.str.strip(), from_text])
+    return codes[codes.str.fullmatch(CPV_CODE)]
+
+# Inverted index of the CPV codes of a table: for every distinct code, the sorted positions of the rows
+# that have it (CSR layout: rows[offsets[i]:offsets[i + 1]] are the rows of codes[i]). Codes are sorted,
+# so the codes under a prefix (79, 7962, ...) are one contiguous range and their rows one slice.
+# Queries return row positions (for df.iloc) or a boolean mask over the rows.
+class CpvIndex:
+    def __init__(self, codes, offsets, rows, n_rows):
+        self.codes = codes
+        self.offsets = offsets
+        self.rows = rows
+        self.n_rows = n_rows
+
+    # Build the index of a column (e.g. df['cpv_number']) with one explode and one sort
+    @classmethod
+    def from_values(cls, values):
+        entries = codes_of(values)
+        code_ids, codes = pd.factorize(entries, sort=True)
+        rows = entries.index.to_numpy()
+
+        # Sort by (code, row) and drop a code repeated in the same row
+        order = np.lexsort((rows, code_ids))
+        code_ids, rows = code_ids[order], rows[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (code_ids[1:] != code_ids[:-1]) | (rows[1:] != rows[:-1])
+        code_ids, rows = code_ids[keep], rows[keep]
+
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(code_ids, minlength=len(codes)), out=offsets[1:])
+        return cls(np.asarray(codes, dtype=str), offsets, rows.astype(np.int32), len(values))
+
+    def save(self, path):
+        np.savez_compressed(path, codes=self.codes, offsets=self.offsets, rows=self.rows, n_rows=self.n_rows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["codes"], data["offsets"], data["rows"], int(data["n_rows"]))
+
+    # Positions of the given codes in self.codes (codes absent from the table are left out)
+    def positions(self, codes):
+        codes = np.asarray(sorted({str(code).strip() for code in codes}), dtype=str)
+        positions = np.searchsorted(self.codes, codes)
+        found = positions < len(self.codes)
+        found[found] = self.codes[positions[found]] == codes[found]
+        return positions[found]
+
+    # Rows with the code
+    def rows_of(self, code):
+        positions = self.positions([code])
+        if not len(positions):
+            return np.empty(0, dtype=np.int32)
+        return self.rows[self.offsets[positions[0]]:self.offsets[positions[0] + 1]]
+
+    # Rows with any of the codes (union)
+    def rows_any(self, codes):
+        positions = self.positions(codes)
+        if not len(positions):
+            return np.empty(0, dtype=np.int32)
+        return self.union([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in positions])
+
+    # Rows with all of the codes (intersection)
+    def rows_all(self, codes):
+        codes = {str(code).strip() for code in codes}
+        positions = self.positions(codes)
+        if not codes or len(positions) < len(codes):
+            return np.empty(0, dtype=np.int32)
+        rows = self.rows[self.offsets[positions[0]]:self.offsets[positions[0] + 1]]
+        for i in positions[1:]:
+            rows = np.intersect1d(rows, self.rows[self.offsets[i]:self.offsets[i + 1]], assume_unique=True)
+        return rows
+
+    # Range of the codes starting with prefix ('79' for division 79)
+    def prefix_range(self, prefix):
+        return (np.searchsorted(self.codes, prefix, side="left"),
+                np.searchsorted(self.codes, prefix + "\uffff", side="left"))
+
+    # Codes of the table starting with prefix
+    def codes_under(self, prefix):
+        start, end = self.prefix_range(prefix)
+        return self.codes[start:end]
+
+    # Rows with a code starting with prefix
+    def rows_under(self, prefix):
+        start, end = self.prefix_range(prefix)
+        return self.union([self.rows[self.offsets[start]:self.offsets[end]]])
+
+    # Sorted distinct rows of several row lists (marked in a mask instead of sorted)
+    def union(self, row_lists):
+        return np.flatnonzero(self.mask(np.concatenate(row_lists))).astype(np.int32)
+
+    # Boolean mask over the rows, e.g. df[index.mask(index.rows_any(codes))]
+    def mask(self, rows):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    # Number of rows of every code (the value counts of the exploded column)
+    def counts(self):
+        return pd.Series(np.diff(self.offsets), index=self.codes, name="rows")
@@ -0,0 +1,153 @@
+import json
+import numpy as np
+import pandas as pd
+
+# Levels of the CPV tree by number of significant digits of the 8-digit code (File19):
+# 2 division (XX000000-Y), 3 group, 4 class, 5 category, 6 to 8 subcategory
+LEVELS = ("division", "group", "class", "category", "subcategory")
+
+CODE_DIGITS = 8
+
+# Significant digits of a code: the digits before its trailing zeros, at least the 2 of the division
+def significant_digits(numbers):
+    digits = np.full(len(numbers), CODE_DIGITS)
+    for count in range(CODE_DIGITS - 1, 1, -1):
+        digits[numbers % 10 ** (CODE_DIGITS - count) == 0] = count
+    return digits
+
+# Range [start, end) of the 8-digit numbers under a prefix of digits ('79', '7962', ...)
+def prefix_bounds(prefix):
+    prefix = str(prefix).strip().split("-")[0]
+    scale = 10 ** (CODE_DIGITS - len(prefix))
+    return int(prefix) * scale, (int(prefix) + 1) * scale
+
+# CPV taxonomy of a table with a CPVcode column (e.g. the TiposContrato_CPV sheet of
+# 16_CPV/TiposContrato_CPV_TED_V1.0.xlsx). The codes are kept as sorted integers, so the subtree
+# of a division, group, class or category is one range found with two binary searches.
+# A code may appear in several rows (one per Tipo de Contrato); rows keep the table order.
+class CpvTree:
+    def __init__(self, table, code_column="CPVcode"):
+        self.table = table
+        numbers = table[code_column].astype(str).str.strip().str[:CODE_DIGITS].astype(np.int64).to_numpy()
+
+        self.order = np.argsort(numbers, kind="stable")
+        self.numbers = numbers[self.order]
+        self.codes = table[code_column].astype(str).str.strip().to_numpy()[self.order]
+
+        digits = significant_digits(self.numbers)
+        self.level_ids = np.minimum(digits, 6) - 2
+
+        # Level name of every row of the table (in table order)
+        levels = np.empty(len(numbers), dtype=object)
+        levels[self.order] = np.asarray(LEVELS, dtype=object)[self.level_ids]
+        self.levels = pd.Series(levels, index=table.index, name="CPVlevel")
+
+        # Parent: the deepest shorter prefix that is itself a code of the table (-1 for the divisions)
+        self.parents = np.full(len(numbers), -1, dtype=np.int64)
+        for count in range(2, CODE_DIGITS):
+            scale = 10 ** (CODE_DIGITS - count)
+            candidates = self.numbers // scale * scale
+            found = (count < digits) & self.contains(candidates)
+            self.parents[found] = candidates[found]
+
+    # Which of the numbers are codes of the table
+    def contains(self, numbers):
+        positions = np.searchsorted(self.numbers, numbers)
+        found = positions < len(self.numbers)
+        found[found] = self.numbers[positions[found]] == numbers[found]
+        return found
+
+    # Sorted positions [start, end) of the codes under a prefix
+    def subtree(self, prefix):
+        low, high = prefix_bounds(prefix)
+        return np.searchsorted(self.numbers, low), np.searchsorted(self.numbers, high)
+
+    # Table rows of sorted positions (in table order)
+    def rows(self, positions):
+        return self.table.iloc[np.sort(self.order[positions])]
+
+    # Rows under a prefix, e.g. tree.under('79') or tree.under('7962')
+    def under(self, prefix):
+        start, end = self.subtree(prefix)
+        return self.rows(np.arange(start, end))
+
+    # Rows of one level, e.g. tree.level('group')
+    def level(self, level):
+        return self.rows(np.flatnonzero(self.level_ids == LEVELS.index(level)))
+
+    # Code of the parent of a code (None for a division or a code without a listed ancestor)
+    def parent(self, code):
+        number = prefix_bounds(code)[0]
+        start = np.searchsorted(self.numbers, number)
+        if start == len(self.numbers) or self.numbers[start] != number or self.parents[start] < 0:
+            return None
+        return self.codes[np.searchsorted(self.numbers, self.parents[start])]
+
+    # Rows of the direct children of a code (searched in its subtree only)
+    def children(self, code):
+        number = prefix_bounds(code)[0]
+        start, end = self.subtree(str(code).split("-")[0].rstrip("0").ljust(2, "0"))
+        return self.rows(start + np.flatnonzero(self.parents[start:end] == number))
+
+# Selection of CPV codes as an ordered list of include / exclude rules, replayed on a CpvTree:
+#   keep      {"keep": column, "values": [...]}       keeps the rows with one of the values
+#   exclude   {"exclude": [prefix, ...]}               drops the subtrees of the prefixes
+#   include   {"include": [prefix, ...]}               adds them back
+#   exclude_ids / include_ids  {"exclude_ids": [ID, ...]} single rows by their ID column
+# Every rule updates a mask over the sorted codes (a range per prefix), so a change is applied
+# at once; save / load keep the rules as JSON to replay the same selection later.
+class CpvSelection:
+    def __init__(self, tree, rules=None, id_column="ID"):
+        self.tree = tree
+        self.id_column = id_column
+        self.rules = []
+        self.mask = np.ones(len(tree.numbers), dtype=bool)
+        for rule in rules or []:
+            self.apply(rule)
+
+    def apply(self, rule):
+        rule = dict(rule)
+        if "keep" in rule:
+            values = self.tree.table[rule["keep"]].to_numpy()[self.tree.order]
+            self.mask &= pd.Series(values).isin(rule["values"]).to_numpy()
+        for action in ("exclude", "include"):
+            for prefix in rule.get(action, []):
+                start, end = self.tree.subtree(prefix)
+                self.mask[start:end] = action == "include"
+            if f"{action}_ids" in rule:
+                ids = self.tree.table[self.id_column].to_numpy()[self.tree.order]
+                self.mask[np.isin(ids, rule[f"{action}_ids"])] = action == "include"
+        self.rules.append(rule)
+        return self.frame()
+
+    def keep(self, column, values):
+        return self.apply({"keep": column, "values": list(values)})
+
+    def exclude(self, prefixes):
+        return self.apply({"exclude": [str(prefix) for prefix in prefixes]})
+
+    def include(self, prefixes):
+        return self.apply({"include": [str(prefix) for prefix in prefixes]})
+
+    def exclude_ids(self, ids):
+        return self.apply({"exclude_ids": [int(row_id) for row_id in ids]})
+
+    def include_ids(self, ids):
+        return self.apply({"include_ids": [int(row_id) for row_id in ids]})
+
+    # Selected rows of the table (in table order)
+    def frame(self):
+        return self.tree.rows(np.flatnonzero(self.mask))
+
+    # Selected codes (sorted, distinct)
+    def codes(self):
+        return sorted(set(self.tree.codes[self.mask]))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"rules": self.rules}, f, indent=1, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, tree, id_column="ID"):
+        with open(path, encoding="utf-8") as f:
+            return cls(tree, json.load(f)["rules"], id_column)
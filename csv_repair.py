@@ -0,0 +1,95 @@
+import os
+import csv
+from instrumentation import add
+from storage import RowWriter
+
+# Read buffer for the raw files
+CHUNK_SIZE = 1024 * 1024
+
+# Encoding used when a record is not valid UTF-8 (the portal files mix UTF-8 and Latin-1)
+FALLBACK_ENCODING = "latin1"
+
+# The CSV field size limit is too small for some 'objectoContrato' values
+csv.field_size_limit(2 ** 31 - 1)
+
+# Decode the raw lines of a file one at a time: UTF-8 first, Latin-1 for the lines that are not UTF-8
+def decode_lines(raw_file, stats):
+    for number, raw_line in enumerate(raw_file):
+        try:
+            line = raw_line.decode("utf-8")
+        except UnicodeDecodeError:
+            line = raw_line.decode(FALLBACK_ENCODING)
+            stats["latin1_lines"] += 1
+        if number == 0:
+            line = line.lstrip("\ufeff")
+        yield line
+
+# Repair a raw ';'-separated CSV in a single streaming pass:
+# - each line is decoded as UTF-8 (or Latin-1) and written to output_path in its storage format
+#   (UTF-8 CSV, or text columns in Parquet / Arrow IPC, see storage.py);
+# - records with more fields than the header are moved to the quarantine file with their line number;
+# - records with fewer fields are completed with empty fields; blank lines are dropped.
+# Memory use does not depend on the file size. Returns the counters of the pass.
+# The output is written under a hidden name and then replaces output_path, so an interrupted repair
+# never leaves a partial file and the folder's mtime (the catalog.py cache key) changes on every rewrite.
+def repair_csv(file_path, output_path, quarantine_path=None):
+    stats = {"rows": 0, "bad_rows": 0, "padded_rows": 0, "blank_lines": 0, "latin1_lines": 0}
+    quarantine_file = None
+    quarantine_writer = None
+    writer = None
+    bytes_read = 0
+    temp_path = os.path.join(os.path.dirname(output_path), "." + os.path.basename(output_path))
+
+    try:
+        with open(file_path, "rb", buffering=CHUNK_SIZE) as raw_file:
+            # Size of the open file: the counters in finally must not fail (and hide the original error)
+            # when file_path was removed or could not be opened
+            bytes_read = os.fstat(raw_file.fileno()).st_size
+            reader = csv.reader(decode_lines(raw_file, stats), delimiter=";")
+
+            header = next(reader, None)
+            if header is None:
+                return stats
+            writer = RowWriter(temp_path, header)
+            num_fields = len(header)
+
+            for record in reader:
+                if not record or record == [""]:
+                    stats["blank_lines"] += 1
+                    continue
+
+                if len(record) > num_fields:
+                    if quarantine_writer is None:
+                        quarantine_file = open(quarantine_path or os.path.splitext(output_path)[0] + "_rejected.csv", "w", encoding="utf-8", newline="")
+                        quarantine_writer = csv.writer(quarantine_file, delimiter=";", lineterminator="\n")
+                        quarantine_writer.writerow(["line"] + header)
+                    quarantine_writer.writerow([reader.line_num] + record)
+                    stats["bad_rows"] += 1
+                    continue
+
+                if len(record) < num_fields:
+                    record = record + [""] * (num_fields - len(record))
+                    stats["padded_rows"] += 1
+
+                writer.write_row(record)
+                stats["rows"] += 1
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+            writer = None
+        raise
+    finally:
+        if writer is not None:
+            writer.close()
+        if quarantine_file is not None:
+            quarantine_file.close()
+        add(rows_in=stats["rows"] + stats["bad_rows"], bytes_read=bytes_read)
+
+    if writer is not None:
+        os.replace(temp_path, output_path)
+    return stats
+
+# Default quarantine file for a repaired file
+def quarantine_path_for(quarantine_folder, file_name):
+    return os.path.join(quarantine_folder, file_name.replace(".csv", "_rejected.csv"))
@@ -0,0 +1,108 @@
+import os
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dimensions import add_names
+from instrumentation import add
+from manifest import parse_file_name
+from storage import BATCH_ROWS, EXTENSIONS, contract_schema, is_up_to_date, read_table, write_table
+
+# Partitioned contract dataset (Hive layout): one Parquet file per harvested query in
+# Ano=YYYY/Mes=M/DistritoId=D/ConcelhoId=C/Tipo=T folders. The partition keys are written once,
+# as folder names, and queries on them only open the matching folders.
+DATASET_FOLDER = '08_ContractDataset'
+
+PARTITION_SCHEMA = pa.schema([
+    ("Ano", pa.int16()),
+    ("Mes", pa.int8()),
+    ("DistritoId", pa.int16()),
+    ("ConcelhoId", pa.int16()),
+    ("Tipo", pa.int16()),
+])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+
+PART_FILE_NAME = "part-0.parquet"
+
+# Partition values of a harvested file, from its name (None when the name has another format)
+def partition_of(file_name):
+    params = parse_file_name(file_name, tuple(EXTENSIONS.values()))
+    if params is None:
+        return None
+    year, month, _ = params["desdedatacontrato"].split("-")
+    return {
+        "Ano": int(year),
+        "Mes": int(month),
+        "DistritoId": params["distrito"],
+        "ConcelhoId": params["concelho"],
+        "Tipo": params["tipo"],
+    }
+
+def partition_path(partition, root=DATASET_FOLDER):
+    return os.path.join(root, *[f"{name}={partition[name]}" for name in PARTITION_SCHEMA.names])
+
+# Write one fixed monthly file (07_) to its partition.
+# Returns the number of rows, or None when the partition is already newer than the file.
+def write_partition(file_path, root=DATASET_FOLDER):
+    file_name = os.path.basename(file_path)
+    partition = partition_of(file_name)
+    if partition is None:
+        raise ValueError(f"Unexpected file name format: {file_name}")
+
+    output_path = os.path.join(partition_path(partition, root), PART_FILE_NAME)
+    if is_up_to_date(output_path, [file_path]):
+        return None
+
+    df = read_table(file_path)
+    save_partition(df, partition, root)
+    return len(df)
+
+# Write the rows of one harvested query to its partition (replacing the previous version)
+def save_partition(df, partition, root=DATASET_FOLDER):
+    folder = partition_path(partition, root)
+    os.makedirs(folder, exist_ok=True)
+
+    # Write to a temporary file first so an interrupted run never leaves a partial partition
+    # (names starting with "_" are ignored by the dataset readers)
+    temp_path = os.path.join(folder, "_" + PART_FILE_NAME)
+    write_table(df, temp_path)
+    os.replace(temp_path, os.path.join(folder, PART_FILE_NAME))
+
+# The dataset restricted to the partitions matching expression, with an explicit schema: the union
+# of the columns of their files (a column that only appears in later exports is kept, null in the
+# older files) typed as in storage.contract_schema, and the partition columns. Only the
+# footers of the selected files are read; a corrupt file raises instead of being left out.
+def open_dataset(expression=None, root=DATASET_FOLDER):
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+    columns = []
+    for fragment in dataset.get_fragments(filter=expression):
+        columns.extend(column for column in fragment.physical_schema.names if column not in columns)
+    return dataset.replace_schema(pa.unify_schemas([contract_schema(columns), PARTITION_SCHEMA]))
+
+# Read the dataset. filters on the partition columns prune whole folders, e.g.
+# [("DistritoId", "==", 12), ("Ano", "==", 2020)]; columns limits the columns read.
+def read_dataset(columns=None, filters=None, root=DATASET_FOLDER):
+    expression = pq.filters_to_expression(filters) if filters else None
+    dataset = open_dataset(expression, root)
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+# All the rows harvested for one year, with the same columns as the yearly files (11_):
+# the names of the tipo, concelho and distrito codes are joined on read (dimensions.py)
+def read_year(year, columns=None, root=DATASET_FOLDER):
+    df = read_dataset(columns=columns, filters=[("Ano", "==", year)], root=root)
+    return add_names(df.drop(columns=[column for column in ("Ano", "Mes") if column in df.columns]))
+
+# Same rows as read_year, in batches of about batch_rows rows
+def iter_year(year, columns=None, batch_rows=BATCH_ROWS, root=DATASET_FOLDER):
+    expression = ds.field("Ano") == year
+    dataset = open_dataset(expression, root)
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_rows):
+        add(rows_in=batch.num_rows)
+        df = batch.to_pandas()
+        yield add_names(df.drop(columns=[column for column in ("Ano", "Mes") if column in df.columns]))
+
+# Years present in the dataset
+def years(root=DATASET_FOLDER):
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(entry.name.split("=", 1)[1]) for entry in os.scandir(root)
+                  if entry.is_dir() and entry.name.startswith("Ano="))
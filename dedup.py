@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from storage import DERIVED_COLUMN_TYPES
+
+# Stable identifier of a contract; rows without it are keyed by a hash of all their portal columns
+ID_COLUMN = "idcontrato"
+
+# 64-bit key of every row: hash of the contract identifier when present, else hash of the portal columns
+# (the derived Tipo/Concelho/Distrito columns are left out, so a contract returned by a district query
+# and by a municipality query gets the same key)
+def row_keys(df):
+    columns = [column for column in df.columns if column not in DERIVED_COLUMN_TYPES]
+    keys = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+    if ID_COLUMN in df.columns:
+        ids = df[ID_COLUMN].astype(str)
+        has_id = (ids != '').to_numpy()
+        keys = np.where(has_id, pd.util.hash_pandas_object(ids, index=False).to_numpy(), keys)
+
+    return keys.view(np.int64)
+
+# Keys of the rows already written, per scope (a year). A row is kept by the first source that
+# writes it; later rows with the same key are dropped as duplicates. The yearly files are always
+# rewritten whole, so the keys only live for one run: ownership never carries over from a previous
+# run (a contract moved to another source, or a source that failed or was skipped, cannot hide rows).
+class DedupIndex:
+    def __init__(self):
+        self.keys = {}
+
+    # Rows of df that are not duplicates, and the number of duplicates dropped
+    def filter(self, df, scope):
+        if df.empty:
+            return df, 0
+
+        keys = row_keys(df)
+        seen = self.keys.setdefault(scope, set())
+        first = ~pd.Series(keys).duplicated().to_numpy()
+        new = np.fromiter((key not in seen for key in keys.tolist()), dtype=bool, count=len(keys))
+        keep = first & new
+        seen.update(keys[keep].tolist())
+
+        return df[keep], int(len(df) - keep.sum())
@@ -0,0 +1,41 @@
+import pandas as pd
+from reference import concelho_descriptions, distrito_names, tipo_descricao_map
+
+# Names by integer code, built once from reference.py
+TIPO_NAMES = {int(code): name for code, name in tipo_descricao_map.items()}
+CONCELHO_NAMES = {int(code): name for code, name in concelho_descriptions.items()}
+DISTRITO_NAMES = {int(code): name for code, name in distrito_names.items()}
+
+# Code and name columns added by the pipeline, in the order of the yearly files
+DERIVED_COLUMNS = ["Tipo", "TipoDescricao", "ConcelhoId", "ConcelhoNome", "DistritoId", "DistritoNome"]
+
+# Name columns and how to compute them: (code column, names by code, name of an unknown code)
+NAME_COLUMNS = {
+    "TipoDescricao": ("Tipo", TIPO_NAMES, lambda code: "Desconhecido"),
+    "ConcelhoNome": ("ConcelhoId", CONCELHO_NAMES, lambda code: f"Unknown ({code})"),
+    "DistritoNome": ("DistritoId", DISTRITO_NAMES, lambda code: f"Unknown ({code})"),
+}
+
+def tipo_name(code):
+    return TIPO_NAMES.get(int(code), "Desconhecido")
+
+def concelho_name(code):
+    return CONCELHO_NAMES.get(int(code), f"Unknown ({code})")
+
+def distrito_name(code):
+    return DISTRITO_NAMES.get(int(code), f"Unknown ({code})")
+
+# Join the names onto fact rows that only hold the codes. Each name column is a categorical:
+# one string per distinct code instead of one per row. The derived columns are moved to the end,
+# in the order of the yearly files.
+def add_names(df):
+    df = df.copy(deep=False)
+    for name_column, (code_column, names, unknown) in NAME_COLUMNS.items():
+        if code_column not in df.columns:
+            continue
+        codes = pd.to_numeric(df[code_column], errors="coerce")
+        lookup = {code: names.get(int(code), unknown(int(code))) for code in codes.dropna().unique()}
+        df[name_column] = codes.map(lookup).astype("category")
+
+    derived = [column for column in DERIVED_COLUMNS if column in df.columns]
+    return df[[column for column in df.columns if column not in derived] + derived]
@@ -0,0 +1,81 @@
+import time
+import threading
+import requests
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from instrumentation import record_http
+
+# Base URL
+BASE_URL = "https://www.base.gov.pt/Base4/pt/resultados/"
+
+# HTTP headers with User-Agent
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/109.0'
+}
+
+# Timeouts in seconds (connect, read)
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# Retry settings: wait BACKOFF_FACTOR * 2 ** (attempt - 1) seconds plus up to BACKOFF_JITTER seconds
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1.0
+BACKOFF_JITTER = 1.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Keep-alive connections kept open to the portal
+POOL_SIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+# Create a session with connection pooling and retries with exponential backoff
+def create_session(max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                   backoff_jitter=BACKOFF_JITTER, pool_size=POOL_SIZE):
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Session shared by every download in the process (created on first use)
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def build_url(params):
+    return BASE_URL + "?" + urlencode(params)
+
+# Request a query from the portal; redirects are followed automatically.
+# The latency (retries included) goes to the HTTP histogram of the run report.
+def fetch(params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+    url = build_url(params)
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, timeout=timeout, allow_redirects=True)
+    except Exception:
+        record_http(time.perf_counter() - start)
+        raise
+    record_http(time.perf_counter() - start, response.status_code, len(response.content))
+    return response, url
+
+# True when the portal answered with a CSV file
+def is_csv_response(response):
+    return response is not None and response.status_code == 200 and "text/csv" in response.headers.get("Content-Type", "")
@@ -0,0 +1,62 @@
+import os
+import errno
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# How File07/File09 place a file in the final folders:
+# "auto" (reflink, else hardlink, else copy), "reflink", "hardlink" or "copy"
+LINK_MODE = os.environ.get("PIPELINE_LINK_MODE", "auto")
+
+LINK_METHODS = {
+    "auto": ("reflink", "hardlink", "copy"),
+    "reflink": ("reflink", "copy"),
+    "hardlink": ("hardlink", "copy"),
+    "copy": ("copy",),
+}
+
+# Linux ioctl that clones the extents of a file (copy-on-write: btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+def reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+# Make destination a reflink / hardlink of source, or a copy when the file system supports neither
+# (e.g. across devices). The new entry replaces destination atomically. Returns the method used,
+# or "same" when destination already is source.
+# Hardlinks share the data with the source: the downloaders replace files (harvester.write_file)
+# instead of rewriting them in place, so a re-download never changes the linked copies.
+def link_file(source, destination, mode=None):
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return "same"
+
+    temp_path = destination + ".tmp"
+    methods = LINK_METHODS[mode or LINK_MODE]
+
+    for method in methods:
+        try:
+            if method == "reflink":
+                reflink(source, temp_path)
+            elif method == "hardlink":
+                os.link(source, temp_path)
+            else:
+                shutil.copy2(source, temp_path)
+            os.replace(temp_path, destination)
+            return method
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if method == methods[-1]:
+                raise
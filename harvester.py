@@ -0,0 +1,268 @@
+import os
+import time
+import asyncio
+import logging
+from urllib.parse import urlparse
+from download_client import BASE_URL, fetch, get_session, is_csv_response
+from instrumentation import add
+from manifest import STATUS_ERROR, STATUS_FAILED, STATUS_OK, query_key
+from query_splitter import hits_limit, merge_csv_contents, split_query
+from row_count import count_records
+from sparsity import LEVEL_DISTRITO, LEVEL_PAIS, group_by_distrito, probe_params
+
+# Default harvest settings
+MAX_CONCURRENCY = 8        # Simultaneous requests to the same host
+REQUESTS_PER_SECOND = 4.0  # Sustained request rate allowed by the token bucket
+BURST = 8                  # Requests that may be sent at once after an idle period
+QUEUE_SIZE = 16            # Pending (month, tipo) groups kept in memory at any time
+
+# Token bucket rate limiter shared by all workers
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Build the query parameters for every (month, district, municipality, type) combination.
+# Queries of the same month and type are consecutive so they can be grouped (see group_queries).
+def build_queries(datas_pesquisa, distritos_concelhos, tipos, base_params):
+    for desdedata, atedata in datas_pesquisa:
+        for tipo in tipos:
+            for distrito, concelhos in distritos_concelhos.items():
+                for concelho in concelhos:
+                    params = base_params.copy()
+                    params.update({
+                        "distrito": distrito,
+                        "concelho": concelho,
+                        "tipo": tipo,
+                        "desdedatacontrato": desdedata,
+                        "atedatacontrato": atedata,
+                    })
+                    yield params
+
+# Group consecutive queries with the same (month, tipo)
+def group_queries(queries):
+    group = []
+    group_key = None
+    for params in queries:
+        key = (params["desdedatacontrato"], params["atedatacontrato"], str(params["tipo"]))
+        if group and key != group_key:
+            yield group
+            group = []
+        group_key = key
+        group.append(params)
+    if group:
+        yield group
+
+# Output file name used by the downstream scripts (File02 to File18)
+def output_file_name(params):
+    return (
+        f"csv_resultados_{params['desdedatacontrato']}_a_{params['atedatacontrato']}"
+        f"_distrito_{params['distrito']}_concelho_{params['concelho']}_tipo_{params['tipo']}.csv"
+    )
+
+# Write a downloaded file through a temporary file and replace the previous version, so a
+# re-download never rewrites a file linked into the final folders (see file_links.py)
+def write_file(path, content):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    os.replace(temp_path, path)
+    add(bytes_written=len(content))
+
+def describe(params):
+    return f"distrito={params['distrito']}, concelho={params['concelho']}, tipo={params['tipo']}, período={params['desdedatacontrato']} a {params['atedatacontrato']}"
+
+class Harvester:
+    def __init__(self, output_folder, distritos_concelhos, manifest=None, sparsity=None,
+                 max_concurrency=MAX_CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST):
+        self.output_folder = output_folder
+        self.distritos_concelhos = distritos_concelhos
+        self.manifest = manifest
+        self.sparsity = sparsity
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst)
+        # Per-host limit on simultaneous requests
+        self.host_limits = {urlparse(BASE_URL).netloc: asyncio.Semaphore(max_concurrency)}
+        self.results = {"ok": 0, "failed": 0, "split": 0, "probes": 0, "skipped": 0}
+        # Keys of the queries whose outcome was recorded
+        self.handled = set()
+
+    def record(self, params, status, **kwargs):
+        self.handled.add(query_key(params))
+        if self.manifest is not None:
+            self.manifest.record(params, status, **kwargs)
+
+    # Request one query through the host limit and the token bucket (the HTTP call runs in a worker thread)
+    async def fetch_limited(self, params):
+        async with self.host_limits[urlparse(BASE_URL).netloc]:
+            await self.bucket.acquire()
+            return await asyncio.to_thread(fetch, params)
+
+    # Download a query, splitting it recursively while it hits the portal result limit.
+    # Returns the CSV contents of the leaf queries (None when the portal gave an invalid response)
+    # and the HTTP status code of the last response.
+    async def fetch_split(self, params):
+        response, url = await self.fetch_limited(params)
+
+        if not is_csv_response(response):
+            logging.warning(f"Invalid response for URL: {url}. Status code: {response.status_code}. Content type: {response.headers.get('Content-Type')}")
+            return None, response.status_code
+
+        num_registros = count_records(response.content)
+        if not hits_limit(num_registros):
+            return [response.content], response.status_code
+
+        children = split_query(params, self.distritos_concelhos)
+        if not children:
+            logging.warning(f"Query still has {num_registros} records and cannot be split further: {url}")
+            return [response.content], response.status_code
+
+        logging.info(f"Query has {num_registros} records, splitting into {len(children)} queries: {url}")
+        self.results["split"] += 1
+        contents = []
+        for child in children:
+            child_contents, status_code = await self.fetch_split(child)
+            if child_contents is None:
+                return None, status_code
+            contents.extend(child_contents)
+        return contents, response.status_code
+
+    # Download a query and save it with its usual file name (split results are merged back)
+    async def download_query(self, params):
+        print(f"Retrieving data: {describe(params)}")
+        try:
+            contents, status_code = await self.fetch_split(params)
+            if contents is None:
+                self.record(params, STATUS_FAILED, http_code=status_code)
+                self.results["failed"] += 1
+                return
+
+            content = contents[0] if len(contents) == 1 else merge_csv_contents(contents)
+            output_file = os.path.join(self.output_folder, output_file_name(params))
+            await asyncio.to_thread(write_file, output_file, content)
+
+            num_registros = count_records(content)
+            self.record(params, STATUS_OK, http_code=status_code, file_path=output_file, content=content, rows=num_registros)
+            self.results["ok"] += 1
+            logging.info(f"The file {output_file} contains {num_registros} records from {len(contents)} queries.")
+            print(f"CSV file saved in: {output_file}")
+        except Exception as e:
+            self.record(params, STATUS_ERROR)
+            self.results["failed"] += 1
+            logging.error(f"Error processing {describe(params)}: {e}")
+
+    # Probe a coarser query; returns its header when the whole subtree is empty, otherwise None
+    async def probe_empty(self, probe):
+        self.results["probes"] += 1
+        try:
+            response, url = await self.fetch_limited(probe)
+        except Exception as e:
+            logging.error(f"Error probing {describe(probe)}: {e}")
+            return None
+        if not is_csv_response(response) or count_records(response.content) > 0:
+            return None
+        logging.info(f"Probe is empty, skipping its queries: {url}")
+        return response.content
+
+    # Save header-only files for the leaves of an empty subtree (no request per leaf)
+    async def save_empty(self, leaves, header):
+        for params in leaves:
+            output_file = os.path.join(self.output_folder, output_file_name(params))
+            await asyncio.to_thread(write_file, output_file, header)
+            self.record(params, STATUS_OK, http_code=200, file_path=output_file, content=header, rows=0)
+            self.results["ok"] += 1
+            self.results["skipped"] += 1
+
+    # Download the leaves of one district, after a district-level probe when it is likely empty
+    async def harvest_distrito(self, distrito, leaves):
+        tipo = leaves[0]["tipo"]
+        if self.sparsity is not None and self.sparsity.should_probe(LEVEL_DISTRITO, distrito, tipo, len(leaves)):
+            header = await self.probe_empty(probe_params(leaves[0], distrito))
+            if header is not None:
+                await self.save_empty(leaves, header)
+                return
+        await asyncio.gather(*(self.download_query(params) for params in leaves))
+
+    # Download the queries of one (month, tipo), after a country-level probe when it is likely empty
+    async def harvest_group(self, leaves):
+        tipo = leaves[0]["tipo"]
+        if self.sparsity is not None and self.sparsity.should_probe(LEVEL_PAIS, 0, tipo, len(leaves)):
+            header = await self.probe_empty(probe_params(leaves[0], 0))
+            if header is not None:
+                await self.save_empty(leaves, header)
+                return
+        # Every district finishes before an error is raised, so the outcomes of the group are final
+        outcomes = await asyncio.gather(*(
+            self.harvest_distrito(distrito, district_leaves)
+            for distrito, district_leaves in group_by_distrito(leaves).items()
+        ), return_exceptions=True)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors:
+            raise errors[0]
+
+    # Record the leaves of a group left without an outcome by an error as failed,
+    # so the run is not reported as complete
+    def fail_unhandled(self, leaves):
+        for params in leaves:
+            if query_key(params) not in self.handled:
+                self.record(params, STATUS_ERROR)
+                self.results["failed"] += 1
+
+    # Worker: takes (month, tipo) groups from the queue until it receives None
+    async def worker(self, queue):
+        while True:
+            leaves = await queue.get()
+            try:
+                if leaves is None:
+                    return
+                await self.harvest_group(leaves)
+            except Exception as e:
+                logging.error(f"Error processing {describe(leaves[0])}: {e}")
+                self.fail_unhandled(leaves)
+            finally:
+                queue.task_done()
+
+    # Run all queries concurrently, bounded per host and by the token bucket.
+    # Queries that hit the result limit are split using the district/municipality grid.
+    # When a manifest is given, every query outcome is recorded in it; with a sparsity index,
+    # subtrees that are likely empty are checked first with one coarser probe query.
+    async def run(self, queries):
+        # Open the shared session before the worker threads start using it
+        get_session()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.max_concurrency)]
+
+        for leaves in group_queries(queries):
+            await queue.put(leaves)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+        if self.sparsity is not None:
+            self.sparsity.rebuild()
+
+        results = self.results
+        message = (f"Harvest completed: {results['ok']} files saved, {results['failed']} failed, "
+                   f"{results['split']} queries split, {results['probes']} probes, {results['skipped']} queries skipped as empty.")
+        logging.info(message)
+        print(message)
+        return results
+
+# Synchronous entry point for the scripts
+def run_harvest(queries, output_folder, distritos_concelhos, manifest=None, sparsity=None, **kwargs):
+    harvester = Harvester(output_folder, distritos_concelhos, manifest, sparsity, **kwargs)
+    return asyncio.run(harvester.run(queries))
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import multiprocessing
+from glob import glob
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Measurements of every run: Logs/Runs/<run id>/records-<pid>.jsonl (one per process) and report.json
+RUNS_FOLDER = os.path.join('Logs', 'Runs')
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets; the last bucket has no upper bound
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120)
+
+# Counters of an item (a file or group processed by a stage)
+COUNTERS = ("rows_in", "rows_out", "bytes_read", "bytes_written")
+
+# One run id for a script and its worker processes, or for every stage of a File26 run
+# (the variable is inherited by the processes started afterwards). Nothing is recorded in a
+# process outside a run, e.g. one that only imports storage.py.
+OWNS_RUN = False
+RUN_ID = os.environ.get("PIPELINE_RUN_ID")
+
+# Script and stage of the measurements (File26 sets the stage name of the scripts it runs)
+SCRIPT = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv and sys.argv[0] else "interactive"))[0]
+STAGE = os.environ.get("PIPELINE_STAGE", SCRIPT)
+
+_lock = threading.Lock()
+_current = None
+_outside = dict.fromkeys(COUNTERS, 0)
+_http = {"requests": 0, "seconds": 0.0, "max": 0.0, "bytes": 0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "status": {}}
+_start = (time.perf_counter(), time.process_time())
+_report_written = False
+_started = False
+
+# Start the run of a script (called by the scripts under __main__): a new run, or the run of the
+# File26 process that started the script. The totals and the report are written at exit.
+def start_run():
+    global OWNS_RUN, RUN_ID, _start, _started
+    if _started:
+        return
+    _started = True
+    OWNS_RUN = "PIPELINE_RUN_ID" not in os.environ
+    RUN_ID = os.environ.setdefault("PIPELINE_RUN_ID", f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+    _start = (time.perf_counter(), time.process_time())
+    atexit.register(finish)
+
+def run_folder(run_id=None):
+    return os.path.join(RUNS_FOLDER, run_id or RUN_ID)
+
+# Peak resident set size of this process (bytes), None where it is not available
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Append one measurement to the records file of this process (nothing outside a run)
+def write_record(record):
+    if RUN_ID is None:
+        return
+    folder = run_folder()
+    os.makedirs(folder, exist_ok=True)
+    with _lock, open(os.path.join(folder, f"records-{os.getpid()}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+# Add to the counters of the current item (or of the script when no item is being measured),
+# e.g. add(rows_in=len(df), bytes_read=size). storage.py, append_writer.py and csv_repair.py call it on every read and write.
+def add(**counters):
+    with _lock:
+        target = _current if _current is not None else _outside
+        for name, value in counters.items():
+            target[name] += value
+
+# Measure one item: wall time, CPU time, peak RSS and the counters added while it runs.
+# run_parallel measures every task; the serial scripts wrap their loop body.
+@contextmanager
+def track(item):
+    global _current
+    record = {"type": "item", "stage": STAGE, "script": SCRIPT, "item": item, **dict.fromkeys(COUNTERS, 0)}
+    previous = _current
+    _current = record
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current = previous
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = time.process_time() - cpu
+        record["peak_rss"] = peak_rss()
+        write_record(record)
+
+# Record one HTTP request of the downloaders (latency in seconds, including the retries)
+def record_http(seconds, status_code=None, size=0):
+    with _lock:
+        _http["requests"] += 1
+        _http["seconds"] += seconds
+        _http["max"] = max(_http["max"], seconds)
+        _http["bytes"] += size
+        _http["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        status = str(status_code)
+        _http["status"][status] = _http["status"].get(status, 0) + 1
+
+# Totals of the script at exit (main process only): wall and CPU time, including the worker
+# processes, peak RSS, the counters outside items and the HTTP histogram. The process that
+# started the run also writes the run report; for File26 its totals are those of the whole run.
+def finish():
+    if multiprocessing.parent_process() is not None:
+        return
+
+    cpu = time.process_time() - _start[1]
+    rss = peak_rss()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += children.ru_utime + children.ru_stime
+        rss = max(rss, children.ru_maxrss * (1 if sys.platform == "darwin" else 1024))
+
+    runner = OWNS_RUN and any(record["type"] == "stage" for record in read_records())
+    record = {"type": "run" if runner else "script", "stage": STAGE, "script": SCRIPT,
+              "wall": time.perf_counter() - _start[0], "cpu": cpu, "peak_rss": rss, **_outside}
+    if _http["requests"]:
+        record["http"] = _http
+    write_record(record)
+
+    if OWNS_RUN and not _report_written:
+        write_report()
+
+def read_records(run_id=None):
+    records = []
+    for path in sorted(glob(os.path.join(run_folder(run_id), "records-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+def merge_http(total, http):
+    if total is None:
+        return json.loads(json.dumps(http))
+    for name in ("requests", "seconds", "bytes"):
+        total[name] += http[name]
+    total["max"] = max(total["max"], http["max"])
+    total["buckets"] = [a + b for a, b in zip(total["buckets"], http["buckets"])]
+    for status, count in http["status"].items():
+        total["status"][status] = total["status"].get(status, 0) + count
+    return total
+
+# Totals per stage. Wall time, CPU time and peak RSS come from the stage records of File26
+# (one per stage, measured on the stage's processes) or else from the script records;
+# the counters add up the items and the work done outside items.
+def summarize(records):
+    stages = {}
+    for record in records:
+        if record["type"] == "run":
+            continue
+        stage = stages.setdefault(record["stage"], {
+            "wall": 0.0, "cpu": 0.0, "peak_rss": None, "items": 0, "failed_items": 0,
+            **dict.fromkeys(COUNTERS, 0), "http": None, "measured_by": "script",
+        })
+
+        if record["type"] == "stage" and stage["measured_by"] == "script":
+            stage.update(wall=0.0, cpu=0.0, peak_rss=None, measured_by="stage")
+        if record["type"] == stage["measured_by"]:
+            stage["wall"] += record["wall"]
+            stage["cpu"] += record["cpu"]
+            if record.get("peak_rss") is not None:
+                stage["peak_rss"] = max(stage["peak_rss"] or 0, record["peak_rss"])
+
+        if record["type"] == "item":
+            stage["items"] += 1
+            stage["failed_items"] += "error" in record
+        if record["type"] in ("item", "script"):
+            for name in COUNTERS:
+                stage[name] += record.get(name, 0)
+        if "http" in record:
+            stage["http"] = merge_http(stage["http"], record["http"])
+
+    for stage in stages.values():
+        if stage["http"]:
+            stage["http"]["mean"] = stage["http"]["seconds"] / stage["http"]["requests"]
+    return stages
+
+# The latest report before run_id, to compare the stage times with
+def previous_report(run_id=None):
+    run_id = run_id or RUN_ID
+    for path in sorted(glob(os.path.join(RUNS_FOLDER, "*", "report.json")), reverse=True):
+        if os.path.basename(os.path.dirname(path)) < run_id:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    return None
+
+# Write Logs/Runs/<run id>/report.json (stage totals, the ten slowest items per stage and every item)
+# and print the summary table, with the change of wall time against the previous report
+def write_report(run_id=None):
+    global _report_written
+    _report_written = True
+    run_id = run_id or RUN_ID
+
+    records = read_records(run_id)
+    items = [record for record in records if record["type"] == "item"]
+    if not records:
+        return None
+
+    report = {
+        "run_id": run_id,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "total": next((record for record in records if record["type"] == "run"), None),
+        "stages": summarize(records),
+        "slowest_items": {
+            stage: sorted((item for item in items if item["stage"] == stage), key=lambda item: item["wall"], reverse=True)[:10]
+            for stage in {item["stage"] for item in items}
+        },
+        "items": items,
+    }
+
+    path = os.path.join(run_folder(run_id), "report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+
+    previous = previous_report(run_id)
+    previous_stages = previous["stages"] if previous else {}
+
+    print(f"\n{'Stage':<36} {'Wall s':>9} {'CPU s':>9} {'RSS MB':>8} {'Items':>7} {'Rows in':>11} {'Rows out':>11} "
+          f"{'MB read':>9} {'MB written':>10} {'HTTP mean s':>11} {'vs prev':>8}")
+    for name, stage in report["stages"].items():
+        rss = f"{stage['peak_rss'] / 2**20:.0f}" if stage["peak_rss"] else "-"
+        http = f"{stage['http']['mean']:.2f}" if stage["http"] else "-"
+        before = previous_stages.get(name, {}).get("wall")
+        change = f"{(stage['wall'] - before) / before:+.0%}" if before else "-"
+        print(f"{name:<36} {stage['wall']:>9.1f} {stage['cpu']:>9.1f} {rss:>8} {stage['items']:>7} {stage['rows_in']:>11} "
+              f"{stage['rows_out']:>11} {stage['bytes_read'] / 2**20:>9.1f} {stage['bytes_written'] / 2**20:>10.1f} "
+              f"{http:>11} {change:>8}")
+    print(f"Run report saved to {path}")
+    return report
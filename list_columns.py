@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# List columns of the API data (File20): entities as "NIPC - name", CPV codes as "CPV - description".
+# A value is a list / array of entries, a string holding a printed list ("[... , ...]"), a single entry or null.
+NIPC_COLUMNS = ("adjudicante", "adjudicatarios", "concorrentes")
+CPV_COLUMN = "cpv"
+
+# (pattern of one entry, pattern of the entries inside a printed list). Descriptions may contain
+# commas, so a printed list is cut at each code followed by a dash instead of at every comma.
+NIPC_PATTERNS = (r'^\s*(\d{9})\s*-\s*(.+)', r'\d{9}\s*-\s*[^,]+(?:, [^,]+)*')
+CPV_PATTERNS = (r'^\s*(\d{8}-\d)\s*-\s*(.+)', r'\d{8}-\d\s*-\s*[^,]+(?:, [^,\[\]]+)*')
+
+# En dash, em dash and minus sign, written as "-" before matching
+DASHES = r'[–—−]'
+
+# Rows parsed at a time (bounds the memory of the exploded entries)
+CHUNK_ROWS = 200000
+
+# One entry per row: lists are exploded once, printed lists are split with one vectorized findall,
+# other strings are a single entry. The index is the row position; rows without entries are absent.
+def entries_of(values, list_pattern):
+    values = values.reset_index(drop=True)
+    kinds = values.map(type)
+
+    from_lists = values[kinds.isin([list, np.ndarray])].explode()
+
+    text = values[kinds == str]
+    bracketed = text.str.startswith("[") & text.str.endswith("]")
+    from_brackets = text[bracketed].str[1:-1].str.strip().str.findall(list_pattern).explode()
+
+    entries = pd.concat([from_lists, from_brackets, text[~bracketed]]).dropna()
+    # All the entries of a row come from the same branch, so a stable sort keeps their order
+    return entries.sort_index(kind="stable").astype(str)
+
+# Split the entries of every row into two list columns (code, description) with one str.extract.
+# Same result as the former per-row parsers of File20: an entry that does not match gives None in
+# both lists, and a row without entries gives None instead of lists.
+def split_entries(values, patterns, chunk_rows=CHUNK_ROWS):
+    entry_pattern, list_pattern = patterns
+    codes = []
+    descriptions = []
+
+    for start in range(0, len(values), chunk_rows):
+        chunk = values.iloc[start:start + chunk_rows]
+        entries = entries_of(chunk, list_pattern)
+
+        parts = entries.str.replace(DASHES, "-", regex=True).str.extract(entry_pattern)
+        parts[1] = parts[1].str.strip()
+        parts = parts.astype(object).where(parts.notna(), None)
+
+        # Back to one list per row: the entries are sorted by row, so each row is one slice
+        # (a groupby(...).agg(list) would call Python once per row through pandas)
+        counts = np.bincount(parts.index.to_numpy(), minlength=len(chunk))
+        bounds = np.concatenate([[0], np.cumsum(counts)]).tolist()
+        for column, lists in ((0, codes), (1, descriptions)):
+            values_list = parts[column].tolist()
+            lists.extend(values_list[start:end] if end > start else None
+                         for start, end in zip(bounds[:-1], bounds[1:]))
+
+    return pd.DataFrame({"code": codes, "description": descriptions}, index=values.index)
+
+# Add <column>_nipc and <column>_description for the entity columns present in df
+def add_nipc_columns(df, columns=NIPC_COLUMNS, chunk_rows=CHUNK_ROWS):
+    for column in columns:
+        if column not in df.columns:
+            continue
+        parsed = split_entries(df[column], NIPC_PATTERNS, chunk_rows)
+        df[f"{column}_nipc"] = parsed["code"]
+        df[f"{column}_description"] = parsed["description"]
+    return df
+
+# Add cpv_number and cpv_description
+def add_cpv_columns(df, column=CPV_COLUMN, chunk_rows=CHUNK_ROWS):
+    if column in df.columns:
+        parsed = split_entries(df[column], CPV_PATTERNS, chunk_rows)
+        df["cpv_number"] = parsed["code"]
+        df["cpv_description"] = parsed["description"]
+    return df
+
+# All the list columns of a table of the API data
+def parse_list_columns(df, chunk_rows=CHUNK_ROWS):
+    add_nipc_columns(df, chunk_rows=chunk_rows)
+    add_cpv_columns(df, chunk_rows=chunk_rows)
+    return df
@@ -0,0 +1,248 @@
+import os
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime
+
+# SQLite file shared by the downloaders (writers) and the verification scripts (readers).
+# Every record belongs to the folder its CSV is saved in (01_RawData for File01/File05,
+# 05_RawDataFinalMonth for File04), so a query saved in one folder is still pending in the other.
+MANIFEST_PATH = "download_manifest.sqlite"
+
+# Download status values
+STATUS_OK = "ok"          # CSV saved
+STATUS_FAILED = "failed"  # Portal answered without a CSV
+STATUS_ERROR = "error"    # Request or processing error
+
+COMMIT_EVERY = 500  # Records written between commits
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    folder TEXT NOT NULL,
+    desdedata TEXT NOT NULL,
+    atedata TEXT NOT NULL,
+    distrito INTEGER NOT NULL,
+    concelho INTEGER NOT NULL,
+    tipo INTEGER NOT NULL,
+    file_path TEXT,
+    status TEXT NOT NULL,
+    http_code INTEGER,
+    bytes INTEGER,
+    rows INTEGER,
+    sha256 TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (folder, desdedata, atedata, distrito, concelho, tipo)
+);
+CREATE INDEX IF NOT EXISTS idx_downloads_status ON downloads (folder, status, bytes);
+CREATE TABLE IF NOT EXISTS imported_folders (
+    folder TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS harvest_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL,
+    desdedata TEXT NOT NULL,
+    atedata TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+"""
+
+# Harvest run status values
+RUN_RUNNING = "running"
+RUN_OK = "ok"                  # Every query was saved
+RUN_INCOMPLETE = "incomplete"  # Some queries failed
+
+# Manifest of the downloads saved in one folder
+class Manifest:
+    def __init__(self, folder, path=MANIFEST_PATH):
+        self.folder = folder
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_dirty ON downloads (folder, dirty)")
+        self.conn.commit()
+        self.pending = 0
+
+    # Bring a manifest created by an older version to the current schema
+    def migrate(self):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(downloads)")}
+        if not columns or "folder" in columns:
+            return
+
+        # Records without a folder: the folder of a saved file is the folder of its path; the other
+        # records (failed queries) are dropped, so they are retried
+        if "dirty" not in columns:
+            self.conn.execute("ALTER TABLE downloads ADD COLUMN dirty INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("DROP INDEX IF EXISTS idx_downloads_status")
+        self.conn.execute("DROP INDEX IF EXISTS idx_downloads_dirty")
+        self.conn.execute("ALTER TABLE downloads RENAME TO downloads_old")
+        self.conn.executescript(SCHEMA)
+        self.conn.create_function("dirname", 1, os.path.dirname)
+        self.conn.execute(
+            "INSERT INTO downloads "
+            "SELECT dirname(file_path), desdedata, atedata, distrito, concelho, tipo, file_path, status, http_code, bytes, rows, sha256, dirty, updated_at "
+            "FROM downloads_old WHERE file_path IS NOT NULL"
+        )
+        self.conn.execute("DROP TABLE downloads_old")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Record the outcome of one query (replaces any previous record for the same query).
+    # A saved CSV that is new or whose content changed since the previous download marks the partition
+    # as dirty: not yet copied downstream. File09 copies the dirty raw files to 05_ and clears the flag.
+    def record(self, params, status, http_code=None, file_path=None, content=None, rows=None):
+        key = query_key(params)
+        size = len(content) if content is not None else None
+        content_hash = hashlib.sha256(content).hexdigest() if content is not None else None
+
+        previous = self.conn.execute(
+            "SELECT sha256, dirty FROM downloads WHERE folder = ? AND desdedata = ? AND atedata = ? AND distrito = ? AND concelho = ? AND tipo = ?",
+            (self.folder, *key),
+        ).fetchone()
+        if status != STATUS_OK:
+            dirty = previous[1] if previous else 0
+        else:
+            dirty = int(previous is None or previous[0] != content_hash or bool(previous[1]))
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO downloads "
+            "(folder, desdedata, atedata, distrito, concelho, tipo, file_path, status, http_code, bytes, rows, sha256, dirty, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.folder, *key, file_path, status, http_code, size, rows, content_hash, dirty,
+             datetime.now().isoformat(timespec="seconds")),
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM downloads WHERE folder = ?", (self.folder,)).fetchone()[0]
+
+    # Keys of the queries whose CSV was saved (optionally only non-empty files)
+    def completed_keys(self, non_empty=False):
+        sql = "SELECT desdedata, atedata, distrito, concelho, tipo FROM downloads WHERE folder = ? AND status = ?"
+        if non_empty:
+            sql += " AND bytes > 0"
+        return set(self.conn.execute(sql, (self.folder, STATUS_OK)))
+
+    # Keys of the queries whose saved CSV is empty
+    def empty_keys(self):
+        sql = "SELECT desdedata, atedata, distrito, concelho, tipo FROM downloads WHERE folder = ? AND status = ? AND bytes = 0"
+        return set(self.conn.execute(sql, (self.folder, STATUS_OK)))
+
+    # Queries from the grid that were never downloaded successfully (or are empty)
+    def pending_queries(self, queries, non_empty=False):
+        done = self.completed_keys(non_empty)
+        for params in queries:
+            if query_key(params) not in done:
+                yield params
+
+    # Partitions (query keys) changed since the downstream stages last consumed them
+    def dirty_keys(self):
+        sql = "SELECT desdedata, atedata, distrito, concelho, tipo FROM downloads WHERE folder = ? AND dirty = 1"
+        return set(self.conn.execute(sql, (self.folder,)))
+
+    def clear_dirty(self, keys):
+        self.conn.executemany(
+            "UPDATE downloads SET dirty = 0 WHERE folder = ? AND desdedata = ? AND atedata = ? AND distrito = ? AND concelho = ? AND tipo = ?",
+            [(self.folder, *key) for key in keys],
+        )
+        self.conn.commit()
+
+    def start_run(self, mode, desdedata, atedata):
+        cursor = self.conn.execute(
+            "INSERT INTO harvest_runs (mode, desdedata, atedata, status, started_at) VALUES (?, ?, ?, ?, ?)",
+            (mode, desdedata, atedata, RUN_RUNNING, datetime.now().isoformat(timespec="seconds")),
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def finish_run(self, run_id, status):
+        self.conn.execute(
+            "UPDATE harvest_runs SET status = ?, finished_at = ? WHERE id = ?",
+            (status, datetime.now().isoformat(timespec="seconds"), run_id),
+        )
+        self.conn.commit()
+
+    # End date of the last harvest that saved every query (falls back to the newest saved query)
+    def last_harvested_date(self):
+        row = self.conn.execute("SELECT MAX(atedata) FROM harvest_runs WHERE status = ?", (RUN_OK,)).fetchone()
+        if row[0] is None:
+            row = self.conn.execute("SELECT MAX(atedata) FROM downloads WHERE folder = ? AND status = ?", (self.folder, STATUS_OK)).fetchone()
+        return row[0]
+
+    # Fill the manifest from the files already in the folder (one directory scan, no file reads).
+    # The folder is imported only once unless force is set.
+    def import_folder(self, force=False):
+        folder = self.folder
+        already = self.conn.execute("SELECT 1 FROM imported_folders WHERE folder = ?", (folder,)).fetchone()
+        if (already and not force) or not os.path.isdir(folder):
+            return 0
+
+        imported = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                params = parse_file_name(entry.name)
+                if params is None or not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO downloads (folder, desdedata, atedata, distrito, concelho, tipo, file_path, status, bytes, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (folder, *query_key(params), entry.path, STATUS_OK, size,
+                     datetime.fromtimestamp(entry.stat().st_mtime).isoformat(timespec="seconds")),
+                )
+                imported += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO imported_folders VALUES (?, ?)",
+            (folder, datetime.now().isoformat(timespec="seconds")),
+        )
+        self.conn.commit()
+        logging.info(f"Imported {imported} files from {folder} into the manifest.")
+        return imported
+
+# Key of a query in the manifest (within a folder)
+def query_key(params):
+    return (
+        str(params["desdedatacontrato"]),
+        str(params["atedatacontrato"]),
+        int(params["distrito"]),
+        int(params["concelho"]),
+        int(params["tipo"]),
+    )
+
+# Parse csv_resultados_{desde}_a_{ate}_distrito_{d}_concelho_{c}_tipo_{t}.csv into query parameters
+# (other extensions, e.g. the storage formats of 07_, can be accepted with extensions)
+def parse_file_name(file_name, extensions=(".csv",)):
+    stem, extension = os.path.splitext(file_name)
+    if extension not in extensions:
+        return None
+    parts = stem.split("_")
+    if len(parts) != 11:
+        return None
+    try:
+        return {
+            "desdedatacontrato": parts[2],
+            "atedatacontrato": parts[4],
+            "distrito": int(parts[6]),
+            "concelho": int(parts[8]),
+            "tipo": int(parts[10]),
+        }
+    except ValueError:
+        return None
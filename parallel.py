@@ -0,0 +1,69 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import track
+
+# Number of worker processes (PIPELINE_WORKERS=1 runs the tasks serially in the main process)
+WORKERS = int(os.environ.get("PIPELINE_WORKERS", os.cpu_count() or 1))
+
+# Log shared by the stages for the files or groups that could not be processed
+FAILED_LOG_FILE = os.path.join('Logs', 'failed_files.log')
+
+# Number of progress messages printed during a run
+PROGRESS_STEPS = 100
+
+# Helper function to log failed files
+def log_failed_file(file_name, error_message, failed_log_file=FAILED_LOG_FILE):
+    os.makedirs(os.path.dirname(failed_log_file) or ".", exist_ok=True)
+    with open(failed_log_file, 'a', encoding='utf-8') as f:
+        f.write(f"Failed to process {file_name}: {error_message}\n")
+
+# Run one task and capture its error instead of stopping the pool.
+# Every task is measured as one item of the run report (see instrumentation.py).
+def run_task(task):
+    func, name, args = task
+    try:
+        with track(name):
+            return name, func(*args), None
+    except Exception as e:
+        return name, None, f"{type(e).__name__}: {e}"
+
+# Run func(*args) for every (name, args) task on a process pool.
+# Results are returned in task order, so output naming does not depend on scheduling.
+# Failed tasks are logged, written to the failed files log and returned with result None.
+# func must be defined at module level, and the calling script must start the pool
+# from inside an `if __name__ == "__main__":` block.
+def run_parallel(func, tasks, workers=None, failed_log_file=FAILED_LOG_FILE, description="Processing"):
+    tasks = [(func, name, args) for name, args in tasks]
+    workers = min(workers or WORKERS, max(len(tasks), 1))
+    total = len(tasks)
+    step = max(total // PROGRESS_STEPS, 1)
+    results = []
+    failed = 0
+
+    logging.info(f"{description}: {total} tasks on {workers} worker(s).")
+
+    if workers == 1:
+        outcomes = map(run_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(total // (workers * 4), 1)
+        outcomes = executor.map(run_task, tasks, chunksize=min(chunksize, 64))
+
+    try:
+        for done, (name, result, error) in enumerate(outcomes, 1):
+            if error is not None:
+                failed += 1
+                logging.error(f"Failed to process {name}: {error}")
+                log_failed_file(name, error, failed_log_file)
+            results.append((name, result))
+
+            if done % step == 0 or done == total:
+                print(f"{description}: {done}/{total} ({failed} failed)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logging.info(f"{description} completed: {total - failed} succeeded, {failed} failed.")
+    return results
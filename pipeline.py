@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import logging
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from catalog import catalog_tree
+from instrumentation import write_record
+
+# Folder of the stage scripts (the data folders are relative to the working directory, as in the scripts)
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Fingerprints and outcome of the last successful run of every stage
+STATE_PATH = "pipeline_state.sqlite"
+
+# Output of the stage scripts, one log per stage
+STAGE_LOG_FOLDER = os.path.join('Logs', 'Pipeline')
+
+# Number of stages run at the same time (each stage already uses all cores through parallel.py)
+MAX_STAGES = int(os.environ.get("PIPELINE_STAGES", 2))
+
+# How inputs and outputs are compared between runs: "mtime" (size and modification time) or
+# "hash" (SHA-256 of the contents, slower but ignores files rewritten with the same data)
+FINGERPRINT_MODE = os.environ.get("PIPELINE_FINGERPRINT", "mtime")
+
+# Data files taken into account in the fingerprints (the logs written into the data folders are not)
+DATA_EXTENSIONS = (".csv", ".parquet", ".arrow")
+
+# Stage outcomes
+STAGE_RUN = "run"
+STAGE_SKIPPED = "skipped"      # Inputs and outputs unchanged since the last successful run
+STAGE_FAILED = "failed"
+STAGE_BLOCKED = "blocked"      # An upstream stage failed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    name TEXT PRIMARY KEY,
+    inputs TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    seconds REAL,
+    finished_at TEXT NOT NULL
+);
+"""
+
+# One stage of the pipeline: the scripts run in order, the folders / files they read and the ones they write
+Stage = namedtuple("Stage", ["name", "scripts", "inputs", "outputs"])
+
+# The processing stages, from the final monthly files (05_) to the yearly files (13_).
+# The download and verification scripts (File01, File03, File04, File05, File10) query the portal
+# and are still run by hand, as are the manual day corrections (02_) of File07/File08/File09 when needed.
+# File11 (File06 that overwrites every file) and File14 (a copy of File12) are not stages:
+# every output has exactly one writer. File13 runs inside the File12 stage, after it, because it
+# updates 08_ in place.
+STAGES = [
+    Stage("row_count", ("File02_VerifyFilesWithMoreThan500Rows.py",),
+          ("01_RawData",), (os.path.join('Logs', 'row_count_report.csv'),)),
+    Stage("organize_days", ("File07_OrganizeFixedFiles.py",),
+          ("02_RawDataDay",), ("03_FixedRawDataDay",)),
+    Stage("month_files", ("File08_OrganizeFixedFilesByMonth.py",),
+          ("03_FixedRawDataDay",), ("04_FixedRawDataMonth",)),
+    Stage("final_month", ("File09_CreateFinalFilesPerMonth.py",),
+          ("01_RawData", "04_FixedRawDataMonth"), ("05_RawDataFinalMonth",)),
+    Stage("fix_csv", ("File06_FixCSVFormatting.py",),
+          ("05_RawDataFinalMonth",), ("07_RawDataFinalMonthFixed",)),
+    Stage("tipo", ("File12_AggregateFilesPerTipo.py", "File13_AddTipoDescription.py"),
+          ("07_RawDataFinalMonthFixed",), ("08_RawDataMonthWithTipo",)),
+    Stage("county", ("File15_AggregateFilesPerDistrict.py",),
+          ("08_RawDataMonthWithTipo",), ("09_RawDataMonthWithCounty",)),
+    Stage("district", ("File16_AggregateFilesPerMonth.py",),
+          ("09_RawDataMonthWithCounty",), ("10_RawDataMonthWithDistrict",)),
+    Stage("year", ("File17_AggregateFilesPerYear.py",),
+          ("10_RawDataMonthWithDistrict",), ("11_RawDataYear",)),
+    Stage("year_filter", ("File18_DeleteWrongYears.py",),
+          ("11_RawDataYear",), ("13_RawDataYearsCorrect", os.path.join('Logs', 'year_filter_report.csv'))),
+    Stage("dataset", ("File24_BuildContractDataset.py",),
+          ("07_RawDataFinalMonthFixed",), ('08_ContractDataset',)),
+]
+
+# Same pipeline with the fused yearly rollup (File25) instead of the 08_ to 11_ cascade
+FUSED_STAGES = [stage for stage in STAGES if stage.name not in ("tipo", "county", "district", "year", "year_filter")] + [
+    Stage("fused_rollup", ("File25_FusedYearlyRollup.py",),
+          ("07_RawDataFinalMonthFixed",), ("13_RawDataYearsCorrect",)),
+]
+
+# Check that every output has one writer
+def check_stages(stages):
+    writers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            output = os.path.normpath(output)
+            if output in writers:
+                raise ValueError(f"{output} is written by both {writers[output]} and {stage.name}")
+            writers[output] = stage.name
+
+# Upstream stages of every stage: the stages that write one of its inputs
+def dependencies(stages):
+    writers = {os.path.normpath(output): stage.name for stage in stages for output in stage.outputs}
+    return {
+        stage.name: {writers[os.path.normpath(path)] for path in stage.inputs if os.path.normpath(path) in writers}
+        for stage in stages
+    }
+
+# The target stages and everything upstream of them
+def select_stages(stages, targets):
+    upstream = dependencies(stages)
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in upstream:
+            raise ValueError(f"Unknown stage: {name}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(upstream[name])
+    return [stage for stage in stages if stage.name in selected]
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Data files of a folder (including the partition subfolders) or a single file, sorted by path
+def data_files(path):
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for folder, _, file_names in os.walk(path):
+        files.extend(os.path.join(folder, name) for name in file_names
+                     if os.path.splitext(name)[1] in DATA_EXTENSIONS and not name.startswith((".", "_")))
+    return sorted(files)
+
+# (path, size, mtime) of the data files of a folder or of a single file. Folders are read through the
+# cached catalogs of catalog.py, so only the folders whose mtime changed since the last run are scanned
+# again (the writers of the data folders replace their files, see catalog.catalog).
+def data_file_stats(path):
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [(path, stat.st_size, stat.st_mtime)]
+    return [(entry.path, entry.size, entry.mtime) for entry in catalog_tree(path, DATA_EXTENSIONS)
+            if not entry.name.startswith("_")]
+
+# Fingerprint of a set of folders / files: changes when a data file is added, removed or modified
+def fingerprint(paths, mode=None):
+    mode = mode or FINGERPRINT_MODE
+    digest = hashlib.sha256()
+    for path in paths:
+        if mode == "hash":
+            signatures = [(file_path, file_digest(file_path)) for file_path in data_files(path)]
+        else:
+            signatures = [(file_path, f"{size}:{mtime}") for file_path, size, mtime in data_file_stats(path)]
+        for file_path, signature in signatures:
+            digest.update(f"{file_path}|{signature}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+class PipelineState:
+    def __init__(self, path=STATE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    # (inputs, outputs) fingerprints of the last successful run, or None
+    def get(self, name):
+        return self.conn.execute("SELECT inputs, outputs FROM stages WHERE name = ?", (name,)).fetchone()
+
+    def record(self, name, inputs, outputs, seconds):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO stages (name, inputs, outputs, seconds, finished_at) VALUES (?, ?, ?, ?, ?)",
+            (name, inputs, outputs, seconds, datetime.now().isoformat(timespec="seconds")),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# Run one stage when its inputs or outputs changed since its last successful run (runs in a thread,
+# the scripts in a subprocess). Returns (outcome, input fingerprint, output fingerprint, seconds).
+def run_stage(stage, previous, force=False, dry_run=False):
+    inputs = fingerprint(stage.inputs)
+    if not force and previous is not None and previous == (inputs, fingerprint(stage.outputs)):
+        return STAGE_SKIPPED, inputs, None, 0.0
+
+    if dry_run:
+        return STAGE_RUN, inputs, None, 0.0
+
+    os.makedirs(STAGE_LOG_FOLDER, exist_ok=True)
+    start = time.perf_counter()
+    record = {"type": "stage", "stage": stage.name, "script": " + ".join(stage.scripts), "cpu": 0.0, "peak_rss": None}
+    outcome = STAGE_RUN
+
+    with open(os.path.join(STAGE_LOG_FOLDER, f"{stage.name}.log"), "w", encoding="utf-8") as log:
+        for script in stage.scripts:
+            log.write(f"=== {script}\n")
+            log.flush()
+            returncode, cpu, rss = run_script(script, stage.name, log)
+            record["cpu"] += cpu
+            if rss is not None:
+                record["peak_rss"] = max(record["peak_rss"] or 0, rss)
+            if returncode != 0:
+                outcome = STAGE_FAILED
+                break
+
+    seconds = time.perf_counter() - start
+    write_record({**record, "wall": seconds, "outcome": outcome})
+    if outcome == STAGE_FAILED:
+        return STAGE_FAILED, inputs, None, seconds
+    return STAGE_RUN, inputs, fingerprint(stage.outputs), seconds
+
+# Run one script in a subprocess, in the run of this process and under the stage's name.
+# Returns (exit code, CPU seconds, peak RSS in bytes) of the script and its worker processes.
+def run_script(script, stage_name, log):
+    env = {**os.environ, "PIPELINE_STAGE": stage_name}
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_FOLDER, script)],
+                               stdout=log, stderr=subprocess.STDOUT, env=env)
+    if not hasattr(os, "wait4"):  # Windows
+        return process.wait(), 0.0, None
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return process.returncode, usage.ru_utime + usage.ru_stime, rss
+
+# Run the stages in dependency order, up to max_stages independent stages at a time.
+# A stage is skipped when its inputs and outputs have the fingerprints of its last successful run
+# (the scripts themselves skip the outputs that are newer than their inputs, so a changed month only
+# rebuilds the files that depend on it). Stages downstream of a failed stage are not run.
+# Returns {stage name: outcome}.
+def run(stages=STAGES, targets=None, force=False, dry_run=False, max_stages=None, state_path=STATE_PATH):
+    check_stages(stages)
+    if targets:
+        stages = select_stages(stages, targets)
+    upstream = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    outcomes = {}
+    running = {}
+
+    state = PipelineState(state_path)
+    executor = ThreadPoolExecutor(max_workers=max_stages or MAX_STAGES)
+    try:
+        while len(outcomes) < len(stages):
+            blocked = 0
+            for stage in stages:
+                if stage.name in outcomes or stage.name in running.values():
+                    continue
+                if any(outcomes.get(name) in (STAGE_FAILED, STAGE_BLOCKED) for name in upstream[stage.name]):
+                    outcomes[stage.name] = STAGE_BLOCKED
+                    blocked += 1
+                    logging.warning(f"Stage {stage.name} blocked by a failed upstream stage.")
+                elif all(name in outcomes for name in upstream[stage.name]):
+                    logging.info(f"Stage {stage.name} started.")
+                    future = executor.submit(run_stage, stage, state.get(stage.name), force, dry_run)
+                    running[future] = stage.name
+
+            if not running:
+                if blocked:
+                    continue
+                pending = [stage.name for stage in stages if stage.name not in outcomes]
+                raise ValueError(f"Stages {pending} depend on each other")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                outcome, inputs, outputs, seconds = future.result()
+                outcomes[name] = outcome
+
+                if outcome == STAGE_RUN and not dry_run:
+                    state.record(name, inputs, outputs, seconds)
+                    logging.info(f"Stage {name} completed in {seconds:.1f} s.")
+                elif outcome == STAGE_FAILED:
+                    logging.error(f"Stage {name} failed after {seconds:.1f} s, see {STAGE_LOG_FOLDER}/{name}.log "
+                                  f"({', '.join(by_name[name].scripts)}).")
+                else:
+                    logging.info(f"Stage {name}: {outcome}.")
+    finally:
+        executor.shutdown()
+        state.close()
+
+    return outcomes
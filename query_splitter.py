@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+# Maximum number of results the portal returns for a single query
+RESULT_LIMIT = 500
+
+# True when a query returned as many records as the portal allows (results may be truncated)
+def hits_limit(num_records):
+    return num_records >= RESULT_LIMIT
+
+# Every day between two dates, both included (the portal treats 'atedatacontrato' as inclusive)
+def generate_days(desdedata, atedata):
+    start = datetime.strptime(desdedata, "%Y-%m-%d")
+    end = datetime.strptime(atedata, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+# Split a query into smaller queries that together return the same results:
+# first district -> municipalities (when the query is not yet per municipality), then period -> days.
+# Returns an empty list when the query cannot be split any further.
+def split_query(params, distritos_concelhos):
+    concelhos = [c for c in distritos_concelhos.get(int(params["distrito"]), []) if c != 0]
+    if str(params["concelho"]) == "0" and concelhos:
+        children = []
+        for concelho in concelhos:
+            child = params.copy()
+            child["concelho"] = concelho
+            children.append(child)
+        return children
+
+    days = generate_days(params["desdedatacontrato"], params["atedatacontrato"])
+    if len(days) > 1:
+        children = []
+        for day in days:
+            child = params.copy()
+            child["desdedatacontrato"] = day
+            child["atedatacontrato"] = day
+            children.append(child)
+        return children
+
+    return []
+
+# Merge the CSV contents of split queries into one file: header of the first file that has one, rows of
+# all files. Empty contents (and blank lines before a header) are skipped.
+def merge_csv_contents(contents):
+    header = None
+    rows = []
+    for content in contents:
+        content = content.lstrip(b"\r\n")
+        if not content.strip():
+            continue
+        first_line, _, body = content.partition(b"\n")
+        if header is None:
+            header = first_line + b"\n"
+        if body.strip():
+            rows.append(body if body.endswith(b"\n") else body + b"\n")
+    return (header or b"") + b"".join(rows)
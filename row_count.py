@@ -0,0 +1,62 @@
+import os
+
+# Read buffer of the file scans
+CHUNK_SIZE = 1024 * 1024
+
+QUOTE = b'"'
+NEWLINE = b'\n'
+
+# Counts CSV records on raw bytes: a newline ends a record only outside a quoted field, so multi-line
+# values (e.g. 'objectoContrato') are one record. Escaped quotes ("") toggle twice and cancel out.
+# No decoding, so UTF-8 and Latin-1 files are counted the same way.
+class RecordCounter:
+    def __init__(self):
+        self.newlines = 0
+        self.in_quotes = False
+        self.bytes = 0
+        self.last_byte = NEWLINE
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self.bytes += len(chunk)
+        self.last_byte = chunk[-1:]
+
+        if not self.in_quotes and QUOTE not in chunk:
+            self.newlines += chunk.count(NEWLINE)
+            return
+
+        # Even parts are outside quotes (odd parts when the chunk starts inside a quoted field)
+        parts = chunk.split(QUOTE)
+        start = 1 if self.in_quotes else 0
+        self.newlines += sum(part.count(NEWLINE) for part in parts[start::2])
+        if (len(parts) - 1) % 2:
+            self.in_quotes = not self.in_quotes
+
+    # Records including the header (a last line without a final newline is a record too)
+    def records(self):
+        return self.newlines + (1 if self.bytes and self.last_byte != NEWLINE else 0)
+
+# Data rows (records minus the header) of a CSV held in memory, e.g. a downloaded response
+def count_records(content):
+    counter = RecordCounter()
+    counter.feed(content)
+    return max(counter.records() - 1, 0)
+
+# Inspect one CSV file with large buffered reads. Returns its size, data rows, and whether
+# it ends inside a quoted field (a truncated or malformed file).
+def inspect_file(file_path):
+    counter = RecordCounter()
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            counter.feed(chunk)
+
+    return {
+        "file": os.path.basename(file_path),
+        "bytes": counter.bytes,
+        "rows": max(counter.records() - 1, 0),
+        "unterminated_quote": counter.in_quotes,
+    }
@@ -0,0 +1,78 @@
+import logging
+from collections import defaultdict
+from manifest import STATUS_OK
+
+# Levels of the query grid that can be proven empty with a single coarser probe query
+LEVEL_PAIS = "pais"          # (month, tipo) for the whole country: distrito=0, concelho=0
+LEVEL_DISTRITO = "distrito"  # (month, distrito, tipo) for all municipalities: concelho=0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sparsity_index (
+    level TEXT NOT NULL,
+    distrito INTEGER NOT NULL,
+    tipo INTEGER NOT NULL,
+    partitions INTEGER NOT NULL,
+    empty INTEGER NOT NULL,
+    PRIMARY KEY (level, distrito, tipo)
+);
+"""
+
+# Share of past monthly partitions of a subtree that were completely empty.
+# Rebuilt from the row counts in the manifest after every harvest.
+REBUILD_SQL = """
+WITH partitions AS (
+    SELECT desdedata, atedata, distrito, tipo, SUM(rows) AS total
+    FROM downloads
+    WHERE folder = ? AND status = ? AND rows IS NOT NULL
+    GROUP BY desdedata, atedata, distrito, tipo
+)
+INSERT INTO sparsity_index
+SELECT ?, distrito, tipo, COUNT(*), SUM(total = 0) FROM partitions GROUP BY distrito, tipo
+UNION ALL
+SELECT ?, 0, tipo, COUNT(*), SUM(total = 0)
+FROM (SELECT desdedata, atedata, tipo, SUM(total) AS total FROM partitions GROUP BY desdedata, atedata, tipo)
+GROUP BY tipo
+"""
+
+class SparsityIndex:
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.manifest.conn.executescript(SCHEMA)
+        self.stats = {}
+        self.load()
+
+    def load(self):
+        rows = self.manifest.conn.execute("SELECT level, distrito, tipo, partitions, empty FROM sparsity_index")
+        self.stats = {(level, distrito, tipo): (partitions, empty) for level, distrito, tipo, partitions, empty in rows}
+
+    # Recompute the index from the manifest and persist it
+    def rebuild(self):
+        conn = self.manifest.conn
+        conn.execute("DELETE FROM sparsity_index")
+        conn.execute(REBUILD_SQL, (self.manifest.folder, STATUS_OK, LEVEL_DISTRITO, LEVEL_PAIS))
+        conn.commit()
+        self.load()
+        logging.info(f"Sparsity index rebuilt with {len(self.stats)} entries.")
+
+    # Estimated probability that a subtree is empty (Laplace smoothing: 0.5 when there is no history)
+    def empty_probability(self, level, distrito, tipo):
+        partitions, empty = self.stats.get((level, int(distrito), int(tipo)), (0, 0))
+        return (empty + 1) / (partitions + 2)
+
+    # A probe costs one request and saves num_leaves requests when the subtree is empty
+    def should_probe(self, level, distrito, tipo, num_leaves):
+        return num_leaves > 1 and self.empty_probability(level, distrito, tipo) * num_leaves > 1
+
+# Group leaf queries of the same (month, tipo) by district
+def group_by_distrito(leaves):
+    groups = defaultdict(list)
+    for params in leaves:
+        groups[int(params["distrito"])].append(params)
+    return groups
+
+# Coarser query covering all the leaves of a subtree
+def probe_params(params, distrito):
+    probe = params.copy()
+    probe["distrito"] = distrito
+    probe["concelho"] = 0
+    return probe
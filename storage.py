@@ -0,0 +1,248 @@
+import os
+import csv
+import json
+from glob import glob
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from instrumentation import add
+
+# Storage format of the intermediate folders (07_ to 13_): "parquet", "arrow" (Arrow IPC) or "csv".
+# The raw downloads (01_ to 06_) are always CSV.
+STORAGE_FORMAT = os.environ.get("PIPELINE_STORAGE", "parquet")
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+PARQUET_COMPRESSION = "zstd"
+ARROW_COMPRESSION = "lz4"
+
+# Rows buffered before a batch is written (row writers)
+BATCH_ROWS = 50000
+
+# Columns added by the pipeline have fixed types; every column from the portal is kept as text
+DERIVED_COLUMN_TYPES = {
+    "Tipo": pa.int16(),
+    "TipoDescricao": pa.string(),
+    "ConcelhoId": pa.int16(),
+    "ConcelhoNome": pa.string(),
+    "DistritoId": pa.int16(),
+    "DistritoNome": pa.string(),
+}
+
+# In Parquet the name columns are dictionary-encoded (read back as pandas categoricals).
+# Arrow IPC files cannot change the dictionary between batches, so they keep plain strings.
+NAME_COLUMN_TYPE = pa.dictionary(pa.int32(), pa.string())
+NAME_COLUMNS = ("TipoDescricao", "ConcelhoNome", "DistritoNome")
+
+# Fixed schema of a contract table: portal columns as strings, derived columns typed
+def contract_schema(columns, storage_format="parquet"):
+    fields = []
+    for column in columns:
+        if column in NAME_COLUMNS and storage_format == "parquet":
+            fields.append(pa.field(column, NAME_COLUMN_TYPE))
+        else:
+            fields.append(pa.field(column, DERIVED_COLUMN_TYPES.get(column, pa.string())))
+    return pa.schema(fields)
+
+def format_of(path):
+    extension = os.path.splitext(path)[1]
+    for storage_format, known_extension in EXTENSIONS.items():
+        if extension == known_extension:
+            return storage_format
+    raise ValueError(f"Unknown storage format for {path}")
+
+# File name for a stem in the configured format, e.g. csv_resultados_2020 -> csv_resultados_2020.parquet
+def file_name(stem, storage_format=None):
+    return stem + EXTENSIONS[storage_format or STORAGE_FORMAT]
+
+# Files of a folder in the configured format
+def list_files(folder, storage_format=None):
+    return sorted(glob(os.path.join(folder, '*' + EXTENSIONS[storage_format or STORAGE_FORMAT])))
+
+# An output is up to date when it exists and is not older than any of its inputs (as in make).
+# The rollups use it to rebuild only the outputs of changed inputs.
+def is_up_to_date(output_path, input_paths):
+    if not os.path.exists(output_path):
+        return False
+    output_mtime = os.path.getmtime(output_path)
+    return all(os.path.getmtime(input_path) <= output_mtime for input_path in input_paths)
+
+# Hidden file next to an output with the list of inputs it was built from
+def inputs_path(output_path):
+    return os.path.join(os.path.dirname(output_path), "." + os.path.basename(output_path) + ".inputs")
+
+# Inputs of an output and the options of the script that changed its content (e.g. File27's lists mode)
+def build_record(input_paths, options=None):
+    return {"inputs": sorted(os.path.normpath(path) for path in input_paths), "options": options or {}}
+
+# Record the inputs (and options) of an output once it has been written
+def record_inputs(output_path, input_paths, options=None):
+    with open(inputs_path(output_path), "w", encoding="utf-8") as f:
+        json.dump(build_record(input_paths, options), f, indent=1)
+
+# Drop the record of an output that is about to be rewritten
+def forget_inputs(output_path):
+    if os.path.exists(inputs_path(output_path)):
+        os.remove(inputs_path(output_path))
+
+# An output of several inputs (the rollups) is up to date when is_up_to_date holds and it was built
+# from the same inputs with the same options: mtimes alone miss an input that was removed or renamed
+# since the last build.
+def is_built_from(output_path, input_paths, options=None):
+    if not is_up_to_date(output_path, input_paths):
+        return False
+    try:
+        with open(inputs_path(output_path), encoding="utf-8") as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return recorded == build_record(input_paths, options)
+
+# Column names of a stored table, read from the header / schema only
+def columns_of(path):
+    storage_format = format_of(path)
+    if storage_format == "parquet":
+        return pq.read_schema(path).names
+    if storage_format == "arrow":
+        with pa.memory_map(path) as source:
+            return ipc.open_file(source).schema.names
+    with open(path, encoding='utf-8', newline='') as f:
+        return next(csv.reader(f, delimiter=';'), [])
+
+# Convert a DataFrame to an Arrow table with the contract schema
+def to_arrow(df, schema):
+    df = df.copy(deep=False)
+    for column, column_type in DERIVED_COLUMN_TYPES.items():
+        if column in df.columns and pa.types.is_integer(column_type):
+            df[column] = pd.to_numeric(df[column])
+    for column in NAME_COLUMNS:
+        if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+# Read a contract table. columns prunes the columns read; filters are pyarrow filters,
+# e.g. [("DistritoId", "==", 12)], pushed down to the row groups for Parquet.
+def read_table(path, columns=None, filters=None):
+    storage_format = format_of(path)
+    table = None
+
+    if storage_format == "parquet":
+        df = pq.read_table(path, columns=columns, filters=filters).to_pandas()
+    elif storage_format == "arrow":
+        with pa.memory_map(path) as source:
+            table = ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        df = pd.read_csv(path, sep=';', encoding='utf-8', on_bad_lines='skip', dtype=str,
+                         keep_default_na=False, usecols=columns)
+        if filters is not None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if table is not None:
+        if filters is not None:
+            table = table.filter(pq.filters_to_expression(filters))
+        df = table.to_pandas()
+
+    add(rows_in=len(df), bytes_read=os.path.getsize(path))
+    return df
+
+# Read a contract table in chunks of about batch_rows rows (DataFrames), without loading the whole file
+def iter_batches(path, columns=None, batch_rows=BATCH_ROWS):
+    add(bytes_read=os.path.getsize(path))
+    for df in read_batches(path, columns, batch_rows):
+        add(rows_in=len(df))
+        yield df
+
+# Batches of iter_batches in each format
+def read_batches(path, columns, batch_rows):
+    storage_format = format_of(path)
+
+    if storage_format == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+    elif storage_format == "arrow":
+        with pa.memory_map(path) as source:
+            reader = ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                if columns is not None:
+                    batch = batch.select(columns)
+                yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, sep=';', encoding='utf-8', on_bad_lines='skip', dtype=str,
+                               keep_default_na=False, usecols=columns, chunksize=batch_rows)
+
+# Write a whole contract table
+def write_table(df, path):
+    storage_format = format_of(path)
+    if storage_format == "csv":
+        df.to_csv(path, index=False, sep=';', encoding='utf-8')
+    else:
+        table = to_arrow(df, contract_schema(list(df.columns), storage_format))
+        if storage_format == "parquet":
+            pq.write_table(table, path, compression=PARQUET_COMPRESSION)
+        else:
+            with ipc.new_file(path, table.schema, options=ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)) as writer:
+                writer.write_table(table)
+    add(rows_out=len(df), bytes_written=os.path.getsize(path))
+
+# Export any stored table to ';'-separated UTF-8 CSV
+def export_csv(path, output_path):
+    read_table(path).to_csv(output_path, index=False, sep=';', encoding='utf-8')
+
+# Incremental writer of Arrow tables to a Parquet or Arrow IPC file (one row group / batch per table)
+class ArrowFileWriter:
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        if format_of(path) == "parquet":
+            self.writer = pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION)
+        else:
+            self.writer = ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression=ARROW_COMPRESSION))
+
+    def write(self, table):
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+# Writes rows given as lists of strings (used by the streaming CSV repair)
+class RowWriter:
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.storage_format = format_of(path)
+        self.batch = []
+        self.rows = 0
+        if self.storage_format == "csv":
+            self.file = open(path, "w", encoding="utf-8", newline="", buffering=1024 * 1024)
+            self.writer = csv.writer(self.file, delimiter=";", lineterminator="\n")
+            self.writer.writerow(header)
+        else:
+            self.writer = ArrowFileWriter(path, contract_schema(header, self.storage_format))
+
+    def write_row(self, row):
+        self.rows += 1
+        if self.storage_format == "csv":
+            self.writer.writerow(row)
+            return
+        self.batch.append(row)
+        if len(self.batch) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        columns = [pa.array(values, type=pa.string()) for values in zip(*self.batch)]
+        self.writer.write(pa.Table.from_arrays(columns, schema=self.writer.schema))
+        self.batch = []
+
+    def close(self):
+        if self.storage_format == "csv":
+            self.file.close()
+        else:
+            self.flush()
+            self.writer.close()
+        add(rows_out=self.rows, bytes_written=os.path.getsize(self.path))
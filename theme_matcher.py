@@ -0,0 +1,137 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Combining marks left by the NFKD decomposition of accented letters (á -> a + ´)
+ACCENTS = f'[{chr(0x300)}-{chr(0x36f)}]'
+
+# Accented forms of the letters of the terms, so the first scan needs no normalized copy of the text
+FOLDED_LETTERS = {"a": "aàáâãä", "e": "eèéêë", "i": "iìíîï", "o": "oòóôõö", "u": "uùúûü", "c": "cç", "n": "nñ"}
+
+# Lower case without accents, so "Saúde", "SAUDE" and "saúde" are the same text
+def normalize(values):
+    return (values.astype("string").fillna("").str.lower()
+            .str.normalize("NFKD").str.replace(ACCENTS, "", regex=True))
+
+# Text of a column for the scan: list / array cells (e.g. adjudicante_description, read from Parquet
+# as numpy arrays) are joined with '; ', other values that are not null are converted with str
+def as_text(values):
+    values = values.reset_index(drop=True).astype(object)
+    kinds = values.map(type)
+    lists = kinds.isin([list, tuple, np.ndarray])
+    text = values.where(kinds == str, None)
+    text[lists] = values[lists].map(lambda items: "; ".join(str(item) for item in items))
+    scalars = ~lists & (kinds != str)
+    scalars[scalars] = values[scalars].notna()
+    text[scalars] = values[scalars].astype(str)
+    return text
+
+# Case- and accent-insensitive regex of a normalized term ("saude" also matches "Saúde")
+def folded_pattern(term):
+    return "".join(f"[{FOLDED_LETTERS[char]}]" if char in FOLDED_LETTERS else re.escape(char) for char in term)
+
+# Regex of a trie of terms: at each position of the text only the branch of the next character is
+# followed, so the cost does not grow with the number of terms. The end of a shorter term is an
+# optional (greedy) group, so the longest term starting at a position is the one matched.
+def trie_pattern(trie):
+    branches = [re.escape(char) + trie_pattern(child) for char, child in sorted(trie.items()) if char != ""]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{pattern})?" if "" in trie else pattern
+
+# Multi-term matcher of a dictionary {theme: [term, ...]} (e.g. temas_cpv of File21), in two passes
+# per text column:
+# 1. all terms of all themes as one case- and accent-insensitive alternation, run by Arrow's RE2
+#    engine (an automaton: one linear scan of the column, whatever the number of terms), which
+#    finds the rows with at least one term;
+# 2. on those rows only, the normalized text is searched for a trie-shaped pattern of the terms with
+#    a zero-width lookahead at every position, so overlapping terms are all found. A match is the
+#    longest term starting at a position; it also counts for the shorter terms it contains.
+class ThemeMatcher:
+    def __init__(self, themes):
+        self.themes = list(themes)
+        terms = {}
+        for theme_id, theme in enumerate(self.themes):
+            for term in normalize(pd.Series(themes[theme])):
+                if term:
+                    terms.setdefault(term, set()).add(theme_id)
+
+        # Themes of a matched term: its own and those of the terms inside it
+        self.term_themes = {
+            term: sorted(set().union(*(ids for other, ids in terms.items() if other in term)))
+            for term in terms
+        }
+
+        trie = {}
+        for term in terms:
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self.pattern = re.compile(f"(?=({trie_pattern(trie)}))")
+        self.scan_pattern = "(?i)" + "|".join(folded_pattern(term) for term in terms)
+
+    # Match the text columns of df (each column is normalized and scanned once)
+    def match(self, df, columns):
+        theme_ids = []
+        rows = []
+        for column in columns:
+            values = as_text(df[column])
+            hits = pc.match_substring_regex(pa.array(values, type=pa.string()), self.scan_pattern)
+            hits = np.flatnonzero(hits.fill_null(False).to_numpy(zero_copy_only=False))
+
+            text = normalize(values.iloc[hits])
+            found = text.str.findall(self.pattern).explode().dropna().map(self.term_themes).explode()
+            theme_ids.append(found.to_numpy(dtype=np.int64))
+            rows.append(found.index.to_numpy(dtype=np.int64))
+        return ThemeMatches.from_pairs(self.themes, np.concatenate(theme_ids), np.concatenate(rows), len(df))
+
+# Sparse theme -> rows membership (CSR: rows[offsets[i]:offsets[i + 1]] are the sorted row positions
+# of themes[i], a row at most once per theme)
+class ThemeMatches:
+    def __init__(self, themes, offsets, rows, n_rows):
+        self.themes = themes
+        self.offsets = offsets
+        self.rows = rows
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_pairs(cls, themes, theme_ids, rows, n_rows):
+        keys = np.unique(theme_ids * max(n_rows, 1) + rows)
+        theme_ids, rows = keys // max(n_rows, 1), keys % max(n_rows, 1)
+        offsets = np.zeros(len(themes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(theme_ids, minlength=len(themes)), out=offsets[1:])
+        return cls(themes, offsets, rows, n_rows)
+
+    # Row positions of a theme
+    def rows_of(self, theme):
+        theme_id = self.themes.index(theme)
+        return self.rows[self.offsets[theme_id]:self.offsets[theme_id + 1]]
+
+    # Boolean mask of the rows of a theme
+    def mask(self, theme):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.rows_of(theme)] = True
+        return mask
+
+    # (theme, start, end) of every theme in self.rows
+    def slices(self):
+        return zip(self.themes, self.offsets[:-1], self.offsets[1:])
+
+    # Theme of every entry of self.rows
+    def theme_of_entries(self):
+        return np.repeat(np.asarray(self.themes, dtype=object), np.diff(self.offsets))
+
+    # Number of rows of every theme
+    def counts(self):
+        return pd.Series(np.diff(self.offsets), index=self.themes, name="rows")
+
+    # Themes of every row (list in theme order, None for a row without themes)
+    def themes_per_row(self):
+        order = np.argsort(self.rows, kind="stable")
+        themes = self.theme_of_entries()[order].tolist()
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(self.rows, minlength=self.n_rows))]).tolist()
+        return pd.Series([themes[start:end] if end > start else None for start, end in zip(bounds[:-1], bounds[1:])])